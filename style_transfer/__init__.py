@@ -0,0 +1,83 @@
+"""Fast neural style transfer as an importable library.
+
+Importing the package is cheap: submodules (and with them TensorFlow) load on
+first attribute access, and the shared ``vgg``, ``loss_model`` and
+``style_model`` are only built when first used::
+
+    import style_transfer
+
+    model = style_transfer.StyleTransferModel()  # imports style_transfer.model
+    style_transfer.loss_model                    # downloads VGG19 weights once
+"""
+
+import importlib
+
+_exports = {
+    "load_image": "utils",
+    "load_url_image": "utils",
+    "array_to_img": "utils",
+    "show_image": "utils",
+    "plot_images_grid": "utils",
+    "content_loss": "losses",
+    "gram_matrix": "losses",
+    "style_loss": "losses",
+    "preceptual_loss": "losses",
+    "content_layers": "loss_network",
+    "style_layers": "loss_network",
+    "content_layers_weights": "loss_network",
+    "style_layers_weights": "loss_network",
+    "LossModel": "loss_network",
+    "StyleTarget": "loss_network",
+    "InstanceNormalization": "layers",
+    "ConditionalInstanceNormalization": "layers",
+    "StyleTransferModel": "model",
+    "input_shape": "model",
+    "default_precision": "precision",
+    "loss_scale_optimizer": "precision",
+    "make_train_step": "training",
+    "train_step": "training",
+    "TrainingMetrics": "training",
+    "TrainingCheckpointer": "training",
+    "TensorflowDatasetLoader": "data",
+    "launch_distributed_training": "distributed",
+    "distributed_scaling_benchmark": "distributed",
+    "BucketedStyleTransfer": "inference",
+    "TiledStyleTransfer": "inference",
+    "stylize_batch": "server",
+    "StyleTransferServer": "server",
+    "stylize_video": "video",
+    "stylize_directory": "bulk",
+    "export_inference_artifact": "export",
+    "quantization_report": "quantization",
+    "StyleRegistry": "registry",
+    "TwoTierCache": "cache",
+    "CachedStylizer": "cache",
+    "run_benchmark_suite": "benchmark",
+    "compare_precisions": "benchmark",
+    "architecture_sweep": "sweep",
+    "make_distill_step": "sweep",
+}
+
+_lazy_models = {
+    "vgg": "get_vgg",
+    "loss_model": "get_loss_model",
+    "style_model": "get_style_model",
+}
+
+__all__ = sorted(_exports) + sorted(_lazy_models)
+
+
+def __getattr__(name):
+    if name in _lazy_models:
+        pretrained = importlib.import_module(".pretrained", __name__)
+        return getattr(pretrained, _lazy_models[name])()
+    if name in _exports:
+        module = importlib.import_module("." + _exports[name], __name__)
+        value = getattr(module, name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
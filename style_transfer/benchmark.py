@@ -0,0 +1,461 @@
+"""Instance normalization and end to end benchmarks."""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import threading
+import time
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.applications import vgg19
+
+from .layers import InstanceNormalization
+from .loss_network import (
+    LossModel,
+    StyleTarget,
+    content_layers,
+    content_layers_weights,
+    style_layers,
+    style_layers_weights,
+)
+from .losses import gram_matrix, preceptual_loss
+from .model import StyleTransferModel
+from .precision import loss_scale_optimizer, policies
+from .training import make_train_step, sync_devices
+
+
+class LegacyInstanceNormalization(tf.keras.layers.Layer):
+    # the original layer, kept only as the "before" side of the benchmark
+    def call(self, inputs):
+        batch, rows, cols, channels = [i for i in inputs.get_shape()]
+        mu, var = tf.nn.moments(inputs, [1, 2], keepdims=True)
+        shift = tf.Variable(tf.zeros([channels]))
+        scale = tf.Variable(tf.ones([channels]))
+        epsilon = 1e-3
+        normalized = (inputs - mu) / tf.sqrt(var + epsilon)
+        return scale * normalized + shift
+
+
+def instance_norm_shapes(batch, height, width):
+    # (channels, downscale) of the 16 InstanceNormalization calls in StyleTransferModel
+    layout = [(32, 1), (64, 2), (128, 4)] + [(128, 4)] * 10 + [(64, 2), (32, 1), (3, 1)]
+    return [(batch, height // d, width // d, c) for c, d in layout]
+
+
+def time_instance_norm(layers, inputs, steps):
+    def forward():
+        return [layer(x) for layer, x in zip(layers, inputs)]
+
+    def backward():
+        with tf.GradientTape() as tape:
+            tape.watch(inputs)
+            loss = tf.add_n([tf.reduce_sum(y) for y in forward()])
+        return tape.gradient(loss, inputs)
+
+    timings = {}
+    for name, fn in [("forward", forward), ("backward", backward)]:
+        fn()
+        start = time.perf_counter()
+        for _ in range(steps):
+            fn()
+        timings[name] = (time.perf_counter() - start) / steps
+    return timings
+
+
+def benchmark_instance_norm(configs=((4, 256, 256), (1, 1080, 1920)), steps=5):
+    results = {}
+    for batch, height, width in configs:
+        shapes = instance_norm_shapes(batch, height, width)
+        inputs = [tf.random.normal(shape) for shape in shapes]
+        for name, layer_cls in [
+            ("before", LegacyInstanceNormalization),
+            ("after", InstanceNormalization),
+        ]:
+            layers = [layer_cls() for _ in shapes]
+            timings = time_instance_norm(layers, inputs, steps)
+            results[(batch, height, width, name)] = timings
+            print(
+                f"batch {batch} {height}x{width} {name:>6}: "
+                f"forward {timings['forward'] * 1000:.1f}ms "
+                f"backward {timings['backward'] * 1000:.1f}ms"
+            )
+    return results
+
+
+class MemorySampler:
+    # polls the resident set size from a thread, ru_maxrss only ever grows so
+    # it can't give a per benchmark peak
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+        self.page_size = os.sysconf("SC_PAGE_SIZE")
+
+    def rss(self):
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * self.page_size
+        except OSError:
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def sample(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, self.rss())
+
+    def __enter__(self):
+        self.peak = self.rss()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+        self.peak = max(self.peak, self.rss())
+
+
+def synthetic_images(batch_size, height, width, seed=0):
+    images = np.random.RandomState(seed).uniform(0, 255, (batch_size, height, width, 3))
+    return tf.constant(images.astype(np.float32))
+
+
+def time_case(fn, batch_size, iterations=20, warmup=3):
+    for _ in range(warmup):
+        fn()
+    sync_devices()
+    latencies = []
+    with MemorySampler() as memory:
+        for _ in range(iterations):
+            start = time.perf_counter()
+            fn()
+            sync_devices()
+            latencies.append(time.perf_counter() - start)
+    latencies = np.array(latencies) * 1000
+    return {
+        "batch_size": batch_size,
+        "iterations": iterations,
+        "mean_ms": float(latencies.mean()),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p90_ms": float(np.percentile(latencies, 90)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "images_per_sec": float(batch_size * 1000 / latencies.mean()),
+        "peak_rss_mb": memory.peak / 2**20,
+    }
+
+
+def make_gatys_iteration(loss_model, content_image, style_grams, learning_rate=0.02):
+    # the per iteration work of the Gatys notebook: VGG forward on the image,
+    # content + style + variation loss, gradient w.r.t. the pixels, Adam, clip
+    image = tf.Variable(content_image / 255.0)
+    content_targets = loss_model.get_activations(image)["content"]
+    optimizer = tf.keras.optimizers.Adam(learning_rate=learning_rate)
+
+    @tf.function
+    def iteration():
+        with tf.GradientTape() as tape:
+            activations = loss_model.get_activations(image)
+            loss = preceptual_loss(
+                activations,
+                content_targets,
+                style_grams,
+                1e4,
+                1e-2,
+                content_layers_weights,
+                style_layers_weights,
+            )
+            loss += 0.0004 * tf.image.total_variation(image)
+        grad = tape.gradient(loss, image)
+        optimizer.apply_gradients([(grad, image)])
+        image.assign(tf.clip_by_value(image, 0.0, 1.0))
+        return loss
+
+    return iteration
+
+
+def run_benchmark_suite(
+    resolutions=((256, 256), (512, 512)),
+    batch_sizes=(1, 4),
+    iterations=20,
+    warmup=3,
+    vgg_weights=None,
+    cases=None,
+    precision="float32",
+    loss_model=None,
+    style_grams=None,
+):
+    # vgg_weights=None runs offline, random weights cost the same as imagenet ones;
+    # a loss_model and style_grams from a cached StyleTarget skip building VGG
+    # and the style pass
+    cases = set(cases or ["inference", "train_step", "activations", "gram_matrix", "gatys"])
+    bench_loss_model = loss_model
+    if bench_loss_model is None:
+        bench_loss_model = LossModel(
+            vgg19.VGG19(weights=vgg_weights, include_top=False),
+            content_layers,
+            style_layers,
+            precision=precision,
+        )
+    results = []
+
+    def record(case, height, width, batch, fn):
+        result = time_case(fn, batch, iterations=iterations, warmup=warmup)
+        result.update(
+            {"case": case, "height": height, "width": width, "precision": precision}
+        )
+        results.append(result)
+        print(
+            f"{case:>12} {height}x{width} batch {batch} {precision}: p50 {result['p50_ms']:.1f}ms "
+            f"p99 {result['p99_ms']:.1f}ms {result['images_per_sec']:.1f} images/sec"
+        )
+
+    bench_model = StyleTransferModel(precision=precision)
+    for height, width in resolutions:
+        # grams are normalized by the map size, one set serves every resolution
+        resolution_grams = style_grams
+        if resolution_grams is None:
+            resolution_grams = StyleTarget(
+                bench_loss_model,
+                synthetic_images(1, height, width, seed=1)[0].numpy() / 255.0,
+            ).grams
+        for batch in batch_sizes:
+            images = synthetic_images(batch, height, width)
+            if "inference" in cases:
+                inference = tf.function(bench_model)
+                record("inference", height, width, batch, lambda: inference(images))
+            if "train_step" in cases:
+                step = make_train_step(
+                    bench_model,
+                    bench_loss_model,
+                    loss_scale_optimizer(
+                        tf.keras.optimizers.Adam(learning_rate=1e-3), precision
+                    ),
+                    resolution_grams,
+                    shared_forward=True,
+                )
+                record("train_step", height, width, batch, lambda: step(images))
+            if "activations" in cases:
+                activations = tf.function(bench_loss_model.get_activations)
+                record("activations", height, width, batch, lambda: activations(images / 255.0))
+            if "gram_matrix" in cases:
+                features = bench_loss_model.get_activations(images / 255.0)["style"]
+                gram = tf.function(gram_matrix)
+                record(
+                    "gram_matrix",
+                    height,
+                    width,
+                    batch,
+                    lambda: [gram(value) for value in features.values()],
+                )
+        if "gatys" in cases:
+            iteration = make_gatys_iteration(
+                bench_loss_model, synthetic_images(1, height, width), resolution_grams
+            )
+            record("gatys", height, width, 1, iteration)
+
+    return {"metadata": benchmark_metadata(), "results": results}
+
+
+def benchmark_metadata():
+    return {
+        "tensorflow": tf.__version__,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "gpus": [device.name for device in tf.config.list_logical_devices("GPU")],
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def benchmark_key(result):
+    key = f"{result['case']}/{result['height']}x{result['width']}/b{result['batch_size']}"
+    # reports from before the precision option are all float32
+    precision = result.get("precision", "float32")
+    return key if precision == "float32" else f"{key}/{precision}"
+
+
+def psnr(reference, image, peak=255.0):
+    mse = float(tf.reduce_mean(tf.square(tf.cast(reference, tf.float32) - image)))
+    return float("inf") if mse == 0 else 10 * np.log10(peak**2 / mse)
+
+
+def cosine_similarity(a, b):
+    a = tf.concat([tf.reshape(tf.cast(g, tf.float32), [-1]) for g in a], axis=0)
+    b = tf.concat([tf.reshape(tf.cast(g, tf.float32), [-1]) for g in b], axis=0)
+    return float(tf.reduce_sum(a * b) / (tf.norm(a) * tf.norm(b)))
+
+
+def compare_precisions(
+    precisions=("bfloat16",),
+    resolution=(256, 256),
+    batch_size=4,
+    iterations=10,
+    warmup=2,
+    train_steps=20,
+    vgg_weights=None,
+    style_model=None,
+):
+    # speed and quality of reduced precision against float32 from the same
+    # weights: stylized output PSNR, loss and gradient agreement on one batch,
+    # then the float32 loss reached after train_steps steps of each precision
+    height, width = resolution
+    vgg = vgg19.VGG19(weights=vgg_weights, include_top=False)
+    images = synthetic_images(batch_size, height, width)
+    style_image = synthetic_images(1, height, width, seed=1)[0].numpy() / 255.0
+    if style_model is None:
+        style_model = StyleTransferModel()
+        style_model(images[:1])
+    initial_weights = style_model.get_weights()
+    reference_loss_model = LossModel(vgg, content_layers, style_layers)
+    style_grams = StyleTarget(reference_loss_model, style_image).grams
+
+    def build(precision):
+        model = StyleTransferModel(precision=precision)
+        model(images[:1])
+        model.set_weights(initial_weights)
+        loss_model = LossModel(vgg, content_layers, style_layers, precision=precision)
+        return model, loss_model
+
+    def loss_and_grads(model, loss_model):
+        # the loss of make_train_step's defaults, without the optimizer update
+        with tf.GradientTape() as tape:
+            outputs = tf.clip_by_value(model(images), 0, 255)
+            pred, content = loss_model.get_paired_activations(outputs / 255.0, images)
+            loss = tf.reduce_mean(
+                preceptual_loss(
+                    pred,
+                    content,
+                    style_grams,
+                    1e4,
+                    1e-2,
+                    content_layers_weights,
+                    style_layers_weights,
+                )
+                + 0.004 * tf.image.total_variation(outputs)
+            )
+        return float(loss), tape.gradient(loss, model.trainable_variables)
+
+    def trained_loss(precision):
+        model, loss_model = build(precision)
+        optimizer = loss_scale_optimizer(tf.keras.optimizers.Adam(learning_rate=1e-3), precision)
+        step = make_train_step(model, loss_model, optimizer, style_grams, shared_forward=True)
+        for _ in range(train_steps):
+            step(images)
+        # always judged by the float32 networks
+        reference_model, _ = build("float32")
+        reference_model.set_weights(model.get_weights())
+        return loss_and_grads(reference_model, reference_loss_model)[0]
+
+    results = {}
+    reference_model, _ = build("float32")
+    reference_output = reference_model(images)
+    reference_loss, reference_grads = loss_and_grads(reference_model, reference_loss_model)
+    for precision in ("float32",) + tuple(p for p in precisions if p != "float32"):
+        model, loss_model = build(precision)
+        inference = tf.function(model)
+        result = {
+            "inference": time_case(
+                lambda: inference(images), batch_size, iterations=iterations, warmup=warmup
+            )
+        }
+        step = make_train_step(
+            model,
+            loss_model,
+            loss_scale_optimizer(tf.keras.optimizers.Adam(learning_rate=1e-3), precision),
+            style_grams,
+            shared_forward=True,
+        )
+        result["train_step"] = time_case(
+            lambda: step(images), batch_size, iterations=iterations, warmup=warmup
+        )
+        model.set_weights(initial_weights)
+        loss, grads = loss_and_grads(model, loss_model)
+        result["output_psnr"] = psnr(reference_output, model(images))
+        result["loss_relative_error"] = abs(loss - reference_loss) / reference_loss
+        result["grad_cosine"] = cosine_similarity(grads, reference_grads)
+        if train_steps:
+            result["trained_loss"] = trained_loss(precision)
+        results[precision] = result
+        print(
+            f"{precision:>9}: inference p50 {result['inference']['p50_ms']:.1f}ms, "
+            f"train step p50 {result['train_step']['p50_ms']:.1f}ms, "
+            f"output PSNR {result['output_psnr']:.1f}dB, "
+            f"loss error {result['loss_relative_error']:.2e}, "
+            f"grad cosine {result['grad_cosine']:.4f}"
+            + (f", loss after {train_steps} steps {result['trained_loss']:.4g}" if train_steps else "")
+        )
+    return {
+        "metadata": benchmark_metadata(),
+        "resolution": list(resolution),
+        "batch_size": batch_size,
+        "results": results,
+    }
+
+
+def compare_benchmark(report, baseline, tolerance=0.1):
+    # a case regresses when its median latency grew by more than tolerance
+    baseline = {benchmark_key(result): result for result in baseline["results"]}
+    regressions = []
+    for result in report["results"]:
+        key = benchmark_key(result)
+        if key not in baseline:
+            continue
+        ratio = result["p50_ms"] / baseline[key]["p50_ms"]
+        flag = "REGRESSION" if ratio > 1 + tolerance else ""
+        print(f"{key:>32}: {baseline[key]['p50_ms']:.1f}ms -> {result['p50_ms']:.1f}ms ({ratio:.2f}x) {flag}")
+        if flag:
+            regressions.append({"key": key, "ratio": ratio})
+    return regressions
+
+
+def benchmark_main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark fast and Gatys style transfer")
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--baseline", default=None, help="earlier --output to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    parser.add_argument("--resolutions", type=int, nargs="+", default=[256, 512])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--cases", nargs="+", default=None)
+    parser.add_argument("--precision", choices=sorted(policies), default="float32")
+    parser.add_argument(
+        "--compare-precisions",
+        nargs="+",
+        choices=sorted(policies),
+        default=None,
+        help="also compare speed and quality of these precisions against float32",
+    )
+    parser.add_argument("--train-steps", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    report = run_benchmark_suite(
+        resolutions=[(size, size) for size in args.resolutions],
+        batch_sizes=args.batch_sizes,
+        iterations=args.iterations,
+        warmup=args.warmup,
+        cases=args.cases,
+        precision=args.precision,
+    )
+    if args.compare_precisions is not None:
+        report["precision_comparison"] = compare_precisions(
+            precisions=args.compare_precisions,
+            resolution=(args.resolutions[0], args.resolutions[0]),
+            batch_size=args.batch_sizes[-1],
+            iterations=args.iterations,
+            warmup=args.warmup,
+            train_steps=args.train_steps,
+        )
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            report["regressions"] = compare_benchmark(report, json.load(f), args.tolerance)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    return 1 if report.get("regressions") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(benchmark_main())
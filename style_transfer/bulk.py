@@ -0,0 +1,207 @@
+"""Resumable stylization of whole image directories."""
+
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+from .inference import BucketedStyleTransfer
+from .model import load_style_model, read_architecture
+from .precision import policies
+from .utils import array_to_img, load_image
+
+
+image_extensions = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+
+
+def find_images(input_dir):
+    paths = [
+        path
+        for path in Path(input_dir).rglob("*")
+        if path.suffix.lower() in image_extensions
+    ]
+    return sorted(paths)
+
+
+def read_manifest(manifest_path, retry_failed=False):
+    done = set()
+    if os.path.isfile(manifest_path):
+        with open(manifest_path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    if "error" in entry and retry_failed:
+                        continue
+                    done.add(entry["input"])
+                except (ValueError, KeyError):
+                    # a killed run can leave a partial last line
+                    continue
+    return done
+
+
+def save_image_atomic(image, output_path):
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    tmp_path = f"{output_path}.tmp{Path(output_path).suffix}"
+    array_to_img(image).save(tmp_path)
+    os.replace(tmp_path, output_path)
+
+
+def stylize_directory(
+    style_model,
+    input_dir,
+    output_dir,
+    dim=(640, 480),
+    batch_size=8,
+    workers=None,
+    output_format=".jpg",
+    batch_fn=None,
+    max_in_flight=None,
+    retry_failed=False,
+):
+    if batch_fn is None:
+        batch_fn = BucketedStyleTransfer(style_model).stylize_batch
+    # decoded images waiting for the model, bounded so memory doesn't grow
+    # with the size of the directory
+    max_in_flight = max_in_flight or 4 * batch_size
+    manifest_path = os.path.join(output_dir, "manifest.jsonl")
+    done = read_manifest(manifest_path, retry_failed=retry_failed)
+    inputs = [
+        path
+        for path in find_images(input_dir)
+        if str(path.relative_to(input_dir)) not in done
+    ]
+    print(f"{len(done)} already done, {len(inputs)} to stylize")
+    os.makedirs(output_dir, exist_ok=True)
+
+    start = time.perf_counter()
+    count = 0
+    failed = 0
+    # TF is not fork safe once its thread pools exist, and the model is loaded
+    # by now; spawned workers only import numpy and PIL for load_image
+    context = multiprocessing.get_context("spawn")
+    with open(manifest_path, "a") as manifest, ProcessPoolExecutor(
+        workers, mp_context=context
+    ) as pool:
+
+        def record(path, **entry):
+            entry = {"input": str(path.relative_to(input_dir)), **entry}
+            manifest.write(json.dumps(entry) + "\n")
+
+        def fail(path, error):
+            # recorded as done, so a resume doesn't trip over the same file
+            nonlocal failed
+            failed += 1
+            record(path, error=f"{type(error).__name__}: {error}")
+            print(f"failed {path}: {error}")
+
+        def stylize(batch_paths, batch):
+            try:
+                return list(zip(batch_paths, batch_fn(batch)))
+            except Exception as e:
+                if len(batch) == 1:
+                    fail(batch_paths[0], e)
+                    return []
+            # find the bad images one at a time
+            outputs = []
+            for path, image in zip(batch_paths, batch):
+                outputs.extend(stylize([path], [image]))
+            return outputs
+
+        remaining = iter(inputs)
+        pending = deque()
+
+        def decode_ahead():
+            # keeps decoding in the workers while the model runs
+            while len(pending) < max_in_flight:
+                path = next(remaining, None)
+                if path is None:
+                    return
+                pending.append((path, pool.submit(load_image, path, dim)))
+
+        decode_ahead()
+        while pending:
+            batch_paths, batch = [], []
+            while pending and len(batch) < batch_size:
+                path, future = pending.popleft()
+                try:
+                    image = future.result()
+                except BrokenProcessPool:
+                    raise
+                except Exception as e:
+                    fail(path, e)
+                    continue
+                batch_paths.append(path)
+                batch.append(image)
+            decode_ahead()
+            if not batch:
+                continue
+            for path, output in stylize(batch_paths, batch):
+                # a.jpg -> a.jpg.jpg, keeping the source suffix so a.jpg and
+                # a.png next to each other don't overwrite one another
+                relative = path.relative_to(input_dir)
+                output_path = os.path.join(output_dir, f"{relative}{output_format}")
+                try:
+                    save_image_atomic(output, output_path)
+                except Exception as e:
+                    fail(path, e)
+                    continue
+                record(path, output=output_path)
+                count += 1
+            manifest.flush()
+    elapsed = time.perf_counter() - start
+    print(
+        f"stylized {count} images in {elapsed:.1f}s "
+        f"({count / max(elapsed, 1e-9):.2f} images/sec), {failed} failed"
+    )
+    return count
+
+
+def bulk_stylize_main(argv=None):
+    parser = argparse.ArgumentParser(description="Stylize every image in a directory")
+    parser.add_argument("input_dir")
+    parser.add_argument("output_dir")
+    parser.add_argument("--checkpoint", required=True, help="path to model_checkpoint.ckpt")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--max-dim", type=int, nargs=2, default=(640, 480))
+    parser.add_argument("--format", default=".jpg")
+    parser.add_argument(
+        "--precision",
+        choices=sorted(policies),
+        default="float32",
+        help="bfloat16 is faster on CPUs with AVX512-BF16/AMX",
+    )
+    parser.add_argument(
+        "--architecture",
+        default=None,
+        help="sweep architecture.json, default the one next to the checkpoint",
+    )
+    parser.add_argument(
+        "--retry-failed", action="store_true", help="retry images a previous run failed on"
+    )
+    args = parser.parse_args(argv)
+
+    architecture = read_architecture(args.checkpoint)
+    if args.architecture is not None:
+        with open(args.architecture) as f:
+            architecture = json.load(f)
+    model = load_style_model(args.checkpoint, precision=args.precision, **architecture)
+    return stylize_directory(
+        model,
+        args.input_dir,
+        args.output_dir,
+        dim=tuple(args.max_dim),
+        batch_size=args.batch_size,
+        workers=args.workers,
+        output_format=args.format,
+        retry_failed=args.retry_failed,
+    )
+
+
+if __name__ == "__main__":
+    bulk_stylize_main()
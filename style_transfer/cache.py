@@ -0,0 +1,213 @@
+"""Content addressed two-tier cache for decoded inputs and stylized outputs."""
+
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from .utils import get_http_session
+
+
+class TwoTierCache:
+    # arrays keyed by content addressed strings, an in-memory LRU in front of an
+    # on-disk store, both bounded in bytes
+    def __init__(self, cache_dir=None, max_memory_mb=256, max_disk_mb=2048):
+        self.cache_dir = cache_dir
+        self.max_memory = max_memory_mb * 1024 * 1024
+        self.max_disk = max_disk_mb * 1024 * 1024
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+        self.disk = OrderedDict()
+        self.disk_bytes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            # oldest access first, hits bump the mtime; .tmp.npy files belong to
+            # writers that are still running or died before os.replace
+            entries = sorted(
+                (
+                    entry
+                    for entry in os.scandir(cache_dir)
+                    if entry.name.endswith(".npy") and not entry.name.endswith(".tmp.npy")
+                ),
+                key=lambda entry: entry.stat().st_mtime,
+            )
+            for entry in entries:
+                self.disk[entry.name[: -len(".npy")]] = entry.stat().st_size
+                self.disk_bytes += entry.stat().st_size
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + ".npy")
+
+    def get(self, key):
+        with self._lock:
+            if key in self.memory:
+                self.memory_hits += 1
+                self.memory.move_to_end(key)
+                return self.memory[key]
+            on_disk = key in self.disk
+            if on_disk:
+                self.disk.move_to_end(key)
+        if on_disk:
+            try:
+                value = np.load(self.path(key))
+                os.utime(self.path(key))
+            except OSError:
+                value = None
+            if value is not None:
+                value.flags.writeable = False
+                with self._lock:
+                    self.disk_hits += 1
+                    self._put_memory(key, value)
+                return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, value):
+        # cached arrays are shared by every caller, they are stored read-only
+        value = np.array(value)
+        value.flags.writeable = False
+        if self.cache_dir is not None:
+            # a temp file per writer, concurrent misses on one key each publish
+            # a complete file and the last os.replace wins
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp.npy")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    np.save(f, value)
+                file_size = os.path.getsize(tmp_path)
+                os.replace(tmp_path, self.path(key))
+            except BaseException:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+                raise
+        with self._lock:
+            self._put_memory(key, value)
+            if self.cache_dir is not None:
+                self.disk_bytes += file_size - self.disk.pop(key, 0)
+                self.disk[key] = file_size
+                while self.disk_bytes > self.max_disk and len(self.disk) > 1:
+                    old_key, size = self.disk.popitem(last=False)
+                    self.disk_bytes -= size
+                    self.evictions += 1
+                    try:
+                        os.remove(self.path(old_key))
+                    except OSError:
+                        pass
+        return value
+
+    def _put_memory(self, key, value):
+        # callers hold self._lock
+        if key in self.memory:
+            self.memory_bytes -= self.memory.pop(key).nbytes
+        self.memory[key] = value
+        self.memory_bytes += value.nbytes
+        while self.memory_bytes > self.max_memory and len(self.memory) > 1:
+            _, old_value = self.memory.popitem(last=False)
+            self.memory_bytes -= old_value.nbytes
+            self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key)
+        if value is None:
+            value = self.put(key, compute())
+        return value
+
+    def metrics(self):
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                "memory_mb": self.memory_bytes / (1024 * 1024),
+                "disk_mb": self.disk_bytes / (1024 * 1024),
+                "evictions": self.evictions,
+            }
+
+
+def model_fingerprint(style_model):
+    # changes whenever the weights do, so retrained styles never hit stale outputs
+    digest = hashlib.sha256()
+    for weight in style_model.weights:
+        digest.update(np.asarray(weight).tobytes())
+    return digest.hexdigest()[:16]
+
+
+class CachedStylizer:
+    def __init__(self, batch_fn, model_version, cache, max_urls=4096, session=None):
+        self.batch_fn = batch_fn
+        self.model_version = model_version
+        self.cache = cache
+        self.session = session or get_http_session()
+        # url -> content hash, repeated URLs skip the download entirely; a URL is
+        # assumed to keep its content for the lifetime of the cache
+        self.url_hashes = OrderedDict()
+        self.max_urls = max_urls
+        self.downloads = 0
+        self._lock = threading.Lock()
+
+    def read_bytes(self, source):
+        if source.startswith(("http://", "https://")):
+            response = self.session.get(source, timeout=60)
+            response.raise_for_status()
+            with self._lock:
+                self.downloads += 1
+            return response.content
+        with open(source, "rb") as f:
+            return f.read()
+
+    def content_hash(self, source):
+        with self._lock:
+            if source in self.url_hashes:
+                self.url_hashes.move_to_end(source)
+                return self.url_hashes[source], None
+        data = self.read_bytes(source)
+        content_hash = hashlib.sha256(data).hexdigest()[:32]
+        if source.startswith(("http://", "https://")):
+            with self._lock:
+                self.url_hashes[source] = content_hash
+                while len(self.url_hashes) > self.max_urls:
+                    self.url_hashes.popitem(last=False)
+        return content_hash, data
+
+    def load(self, source, dim=(640, 480)):
+        content_hash, data = self.content_hash(source)
+        return self.load_decoded(source, content_hash, data, dim)
+
+    def load_decoded(self, source, content_hash, data, dim):
+        def decode():
+            raw = data if data is not None else self.read_bytes(source)
+            img = Image.open(BytesIO(raw))
+            img.thumbnail(dim)
+            return np.array(img.convert("RGB"))
+
+        return self.cache.get_or_compute(
+            f"input-{content_hash}-{dim[0]}x{dim[1]}", decode
+        )
+
+    def __call__(self, source, dim=(640, 480)):
+        content_hash, data = self.content_hash(source)
+        key = f"output-{self.model_version}-{content_hash}-{dim[0]}x{dim[1]}"
+        return self.cache.get_or_compute(
+            key,
+            lambda: self.batch_fn([self.load_decoded(source, content_hash, data, dim)])[0],
+        )
+
+    def metrics(self):
+        metrics = self.cache.metrics()
+        metrics["downloads"] = self.downloads
+        metrics["cached_urls"] = len(self.url_hashes)
+        return metrics
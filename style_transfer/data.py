@@ -0,0 +1,144 @@
+"""COCO input pipeline with an optional TFRecord cache."""
+
+import json
+import os
+from pathlib import Path
+
+import tensorflow as tf
+
+
+class TensorflowDatasetLoader:
+    def __init__(
+        self,
+        dataset_path,
+        batch_size=4,
+        image_size=(256, 256),
+        num_images=None,
+        record_dir=None,
+        shuffle_buffer=None,
+        seed=None,
+        num_shards=1,
+        shard_index=0,
+    ):
+        images_paths = sorted(str(path) for path in Path(dataset_path).glob("*.jpg"))
+        if num_images is not None:
+            images_paths = images_paths[0:num_images]
+        self.length = len(images_paths[shard_index::num_shards])
+        if record_dir is not None:
+            record_files, record_counts = self.write_records(
+                images_paths, record_dir, image_size
+            )
+            # read_records shards whole files when there are enough of them,
+            # count what this worker reads rather than every num_shards-th image
+            self.length = self.records_length(record_counts, num_shards, shard_index)
+            dataset = self.read_records(
+                record_files, image_size, num_shards, shard_index, seed, shuffle_buffer
+            )
+            if shuffle_buffer:
+                dataset = dataset.shuffle(shuffle_buffer, seed=seed)
+        else:
+            dataset = tf.data.Dataset.from_tensor_slices(images_paths)
+            dataset = dataset.shard(num_shards, shard_index)
+            if shuffle_buffer:
+                # shuffling paths is cheap, shuffle all of them before decoding
+                dataset = dataset.shuffle(max(self.length, 1), seed=seed)
+            dataset = dataset.map(
+                lambda path: self.load_tf_image(path, dim=image_size),
+                num_parallel_calls=tf.data.experimental.AUTOTUNE,
+                deterministic=seed is not None,
+            )
+        dataset = dataset.batch(batch_size, drop_remainder=True)
+        dataset = dataset.repeat()
+        dataset = dataset.prefetch(buffer_size=tf.data.experimental.AUTOTUNE)
+        self.dataset = dataset
+
+    def __len__(self):
+        return self.length
+
+    def load_tf_image(self, image_path, dim):
+        image = tf.io.read_file(image_path)
+        image = tf.image.decode_jpeg(image, channels=3)
+        image = tf.image.resize(image, dim)
+        image = image / 255.0
+        return image
+
+    def write_records(self, images_paths, record_dir, image_size, images_per_shard=2000):
+        # decode and resize every image once, keep it as raw uint8 pixels
+        height, width = image_size
+        record_dir = os.path.join(record_dir, f"{height}x{width}")
+        index_path = os.path.join(record_dir, "index.json")
+        if os.path.isfile(index_path):
+            with open(index_path) as f:
+                index = json.load(f)
+            if index["images"] == images_paths:
+                # indexes written before the counts were recorded used the
+                # default images_per_shard
+                counts = index.get("counts") or self.shard_counts(
+                    len(images_paths), images_per_shard
+                )
+                files = [os.path.join(record_dir, name) for name in index["shards"]]
+                return files, counts
+        os.makedirs(record_dir, exist_ok=True)
+        dataset = tf.data.Dataset.from_tensor_slices(images_paths).map(
+            lambda path: tf.cast(
+                tf.round(self.load_tf_image(path, dim=image_size) * 255.0), tf.uint8
+            ),
+            num_parallel_calls=tf.data.experimental.AUTOTUNE,
+        )
+        counts = self.shard_counts(len(images_paths), images_per_shard)
+        num_shards = len(counts)
+        shards = [f"images-{i:05d}-of-{num_shards:05d}.tfrecord" for i in range(num_shards)]
+        iterator = iter(dataset)
+        for name, count in zip(shards, counts):
+            tmp_path = os.path.join(record_dir, name + ".tmp")
+            with tf.io.TFRecordWriter(tmp_path) as writer:
+                for _ in range(count):
+                    writer.write(next(iterator).numpy().tobytes())
+            os.replace(tmp_path, os.path.join(record_dir, name))
+        with open(index_path, "w") as f:
+            json.dump(
+                {"images": images_paths, "shards": shards, "counts": counts}, f
+            )
+        return [os.path.join(record_dir, name) for name in shards], counts
+
+    def shard_counts(self, num_images, images_per_shard):
+        num_shards = max(-(-num_images // images_per_shard), 1)
+        return [
+            max(min(images_per_shard, num_images - i * images_per_shard), 0)
+            for i in range(num_shards)
+        ]
+
+    def records_length(self, record_counts, num_shards, shard_index):
+        # mirrors the sharding in read_records
+        if len(record_counts) >= num_shards:
+            return sum(record_counts[shard_index::num_shards])
+        return len(range(shard_index, sum(record_counts), num_shards))
+
+    def read_records(
+        self, record_files, image_size, num_shards, shard_index, seed, shuffle_buffer=None
+    ):
+        height, width = image_size
+        files = tf.data.Dataset.from_tensor_slices(record_files)
+        if len(record_files) >= num_shards:
+            files = files.shard(num_shards, shard_index)
+            # like the jpeg path, the order only changes when a shuffle is asked for
+            if shuffle_buffer:
+                files = files.shuffle(len(record_files), seed=seed)
+            dataset = files.interleave(
+                tf.data.TFRecordDataset,
+                num_parallel_calls=tf.data.experimental.AUTOTUNE,
+                deterministic=seed is not None or not shuffle_buffer,
+            )
+        else:
+            # too few files to split, every worker reads all of them in the same
+            # fixed order and keeps every num_shards-th image, so the shards
+            # stay disjoint; the shuffle buffer after this mixes them
+            dataset = files.flat_map(tf.data.TFRecordDataset)
+            dataset = dataset.shard(num_shards, shard_index)
+        return dataset.map(
+            lambda record: tf.reshape(
+                tf.cast(tf.io.decode_raw(record, tf.uint8), tf.float32) / 255.0,
+                [height, width, 3],
+            ),
+            num_parallel_calls=tf.data.experimental.AUTOTUNE,
+        )
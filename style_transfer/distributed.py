@@ -0,0 +1,212 @@
+"""Data parallel training across local worker processes."""
+
+import multiprocessing
+import os
+import queue
+import socket
+import time
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.applications import vgg19
+
+from .data import TensorflowDatasetLoader
+from .loss_network import (
+    LossModel,
+    content_layers,
+    content_layers_weights,
+    style_layers,
+    style_layers_weights,
+)
+from .model import StyleTransferModel, save_style_model
+from .precision import loss_scale_optimizer
+from .training import make_train_step
+
+
+# workers are spawned (TF is not fork safe once its thread pools exist) and
+# import distributed_train_worker from this module
+def free_ports(count):
+    sockets = [socket.socket() for _ in range(count)]
+    for sock in sockets:
+        sock.bind(("localhost", 0))
+    ports = [sock.getsockname()[1] for sock in sockets]
+    for sock in sockets:
+        sock.close()
+    return ports
+
+
+def worker_cores(task_index, num_workers):
+    # contiguous slices keep a worker on one socket on multi-socket boxes
+    cores = sorted(os.sched_getaffinity(0))
+    per_worker = max(len(cores) // num_workers, 1)
+    start = (task_index * per_worker) % len(cores)
+    return cores[start : start + per_worker]
+
+
+def distributed_train_worker(task_index, addresses, config, results):
+    cores = worker_cores(task_index, len(addresses))
+    os.sched_setaffinity(0, cores)
+    # thread pools are sized when the runtime starts, before the strategy exists
+    tf.config.threading.set_intra_op_parallelism_threads(len(cores))
+    tf.config.threading.set_inter_op_parallelism_threads(2)
+    resolver = tf.distribute.cluster_resolver.SimpleClusterResolver(
+        tf.train.ClusterSpec({"worker": addresses}),
+        task_type="worker",
+        task_id=task_index,
+        rpc_layer="grpc",
+    )
+    strategy = tf.distribute.MultiWorkerMirroredStrategy(cluster_resolver=resolver)
+
+    # every worker reads its own shard, the global batch is batch_size * workers
+    loader = TensorflowDatasetLoader(
+        config["dataset_path"],
+        batch_size=config["batch_size"],
+        image_size=config["image_size"],
+        num_images=config["num_images"],
+        record_dir=config["record_dir"],
+        shuffle_buffer=config["shuffle_buffer"],
+        seed=0,
+        num_shards=len(addresses),
+        shard_index=task_index,
+    )
+    with strategy.scope():
+        style_model = StyleTransferModel(precision=config["precision"])
+        style_model(tf.zeros((1, *config["image_size"], 3)))
+        optimizer = loss_scale_optimizer(
+            tf.keras.optimizers.Adam(learning_rate=config["learning_rate"]),
+            config["precision"],
+        )
+    loss_model = LossModel(
+        vgg19.VGG19(weights=config["vgg_weights"], include_top=False),
+        config["content_layers"],
+        config["style_layers"],
+        precision=config["precision"],
+    )
+    step = make_train_step(
+        style_model,
+        loss_model,
+        optimizer,
+        config["style_grams"],
+        config["content_weight"],
+        config["style_weight"],
+        config["total_variation_weight"],
+        config["content_layers_weights"],
+        config["style_layers_weights"],
+        shared_forward=True,
+        num_replicas=strategy.num_replicas_in_sync,
+    )
+
+    @tf.function
+    def distributed_step(batch):
+        return strategy.run(step, args=(batch,))
+
+    iterator = iter(loader.dataset)
+    for _ in range(config["warmup_steps"]):
+        distributed_step(next(iterator))
+    start = time.perf_counter()
+    losses = []
+    for _ in range(config["steps"]):
+        losses.append(distributed_step(next(iterator)))
+    float(tf.reduce_mean(losses[-1]))
+    elapsed = time.perf_counter() - start
+    if task_index == 0 and config["checkpoint_path"] is not None:
+        save_style_model(style_model, config["checkpoint_path"])
+    results.put(
+        {
+            "task_index": task_index,
+            "steps_per_sec": config["steps"] / elapsed,
+            "loss": float(tf.reduce_mean(losses)),
+        }
+    )
+
+
+def distributed_training_config(dataset_path, style_grams, **overrides):
+    config = dict(
+        dataset_path=dataset_path,
+        style_grams={name: np.asarray(gram) for name, gram in style_grams.items()},
+        batch_size=4,
+        image_size=(256, 256),
+        num_images=None,
+        record_dir=None,
+        shuffle_buffer=1024,
+        learning_rate=1e-3,
+        vgg_weights="imagenet",
+        content_layers=content_layers,
+        style_layers=style_layers,
+        content_layers_weights=content_layers_weights,
+        style_layers_weights=style_layers_weights,
+        content_weight=1e1,
+        style_weight=1e2,
+        total_variation_weight=0.004,
+        precision="float32",
+        warmup_steps=2,
+        steps=100,
+        checkpoint_path=None,
+    )
+    config.update(overrides)
+    return config
+
+
+def launch_distributed_training(num_workers, config, timeout=None):
+    if config["record_dir"] is not None:
+        # write the shared TFRecord shards once, before the workers race to create them
+        TensorflowDatasetLoader(
+            config["dataset_path"],
+            image_size=config["image_size"],
+            num_images=config["num_images"],
+            record_dir=config["record_dir"],
+        )
+    addresses = [f"localhost:{port}" for port in free_ports(num_workers)]
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    workers = [
+        context.Process(
+            target=distributed_train_worker, args=(i, addresses, config, results)
+        )
+        for i in range(num_workers)
+    ]
+    for worker in workers:
+        worker.start()
+    reports = []
+    deadline = None if timeout is None else time.monotonic() + timeout
+    try:
+        while len(reports) < num_workers:
+            try:
+                reports.append(results.get(timeout=1))
+            except queue.Empty:
+                # a crashed worker leaves the others blocked in a collective forever
+                failed = [w.exitcode for w in workers if w.exitcode not in (None, 0)]
+                if failed:
+                    raise RuntimeError(f"distributed worker exited with code {failed[0]}")
+                if deadline is not None and time.monotonic() > deadline:
+                    raise TimeoutError(f"{num_workers} workers did not finish in {timeout}s")
+    finally:
+        for worker in workers:
+            worker.join(timeout=10)
+            if worker.is_alive():
+                worker.terminate()
+    reports.sort(key=lambda report: report["task_index"])
+    # workers advance in lockstep, the slowest one sets the pace
+    steps_per_sec = min(report["steps_per_sec"] for report in reports)
+    return {
+        "workers": num_workers,
+        "steps_per_sec": steps_per_sec,
+        "images_per_sec": steps_per_sec * config["batch_size"] * num_workers,
+        "loss": reports[0]["loss"],
+    }
+
+
+def distributed_scaling_benchmark(config, worker_counts=(1, 2, 4, 8), timeout=None):
+    runs = []
+    for num_workers in worker_counts:
+        run = launch_distributed_training(num_workers, config, timeout=timeout)
+        base = runs[0] if runs else run
+        run["speedup"] = run["images_per_sec"] / base["images_per_sec"]
+        run["efficiency"] = run["speedup"] * base["workers"] / num_workers
+        runs.append(run)
+        print(
+            f"{num_workers} workers: {run['steps_per_sec']:.2f} steps/sec, "
+            f"{run['images_per_sec']:.1f} images/sec, speedup {run['speedup']:.2f}x, "
+            f"efficiency {run['efficiency']:.0%}"
+        )
+    return runs
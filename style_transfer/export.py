@@ -0,0 +1,140 @@
+"""SavedModel and TFLite export of a trained style."""
+
+import argparse
+import json
+import os
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.framework.convert_to_constants import (
+    convert_variables_to_constants_v2,
+)
+
+from .bulk import find_images
+from .inference import BucketedStyleTransfer, inference_buckets
+from .model import input_shape, load_style_model, read_architecture, with_precision
+from .utils import load_image
+
+
+def representative_inputs(image, with_sizes=False):
+    image = np.asarray(image, dtype=np.float32)
+    if not with_sizes:
+        return [image[np.newaxis]]
+    # calibration images fill the whole bucket, nothing is padding
+    return [image[np.newaxis], np.array([image.shape[:2]], dtype=np.int32)]
+
+
+def convert_to_tflite(
+    concrete_function, quantization, representative_images=None, with_sizes=False
+):
+    # freeze explicitly, otherwise newer converters keep the weights as
+    # resource variables that the interpreter never initializes
+    frozen = convert_variables_to_constants_v2(concrete_function)
+    converter = tf.lite.TFLiteConverter.from_concrete_functions([frozen])
+    if quantization is not None:
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == "int8":
+        assert representative_images is not None, "int8 needs calibration images"
+        converter.representative_dataset = lambda: (
+            representative_inputs(image, with_sizes) for image in representative_images
+        )
+    elif quantization is not None:
+        raise ValueError(f"unknown tflite quantization: {quantization}")
+    return converter.convert()
+
+
+def export_inference_artifact(
+    style_model,
+    export_dir,
+    buckets=inference_buckets,
+    tflite=None,
+    representative_images=None,
+):
+    def signature(shape, model=style_model):
+        # "sizes" are the unpadded height and width of each image, instance norm
+        # moments skip the padding exactly like BucketedStyleTransfer
+        bucketed = BucketedStyleTransfer(model, buckets)
+
+        def forward(inputs, sizes):
+            return {"stylized": bucketed._forward(inputs, sizes)}
+
+        spec = tf.TensorSpec(shape=shape, dtype=tf.float32, name="image")
+        sizes = tf.TensorSpec(shape=(shape[0], 2), dtype=tf.int32, name="sizes")
+        return tf.function(forward, input_signature=[spec, sizes]).get_concrete_function()
+
+    signatures = {
+        f"stylize_{height}x{width}": signature((None, height, width, 3))
+        for height, width in buckets
+    }
+    signatures["serving_default"] = signature((None, None, None, 3))
+    module = tf.Module()
+    module.style_model = style_model
+    tf.saved_model.save(module, export_dir, signatures=signatures)
+    metadata = {"buckets": [list(bucket) for bucket in buckets], "multiple": 4}
+
+    if tflite is not None:
+        # TFLite builtin ops need fully static shapes, so every bucket is
+        # converted at batch 1 into its own .tflite file
+        metadata["tflite"] = {}
+        # the TFLite builtin ops have no bfloat16 kernels
+        float32_model = with_precision(style_model, "float32")
+        for height, width in buckets:
+            calibration = None
+            if representative_images is not None:
+                calibration = [
+                    tf.image.resize(image, (height, width)).numpy()
+                    for image in representative_images
+                ]
+            tflite_name = f"model_{height}x{width}_{tflite}.tflite"
+            with open(os.path.join(export_dir, tflite_name), "wb") as f:
+                f.write(
+                    convert_to_tflite(
+                        signature((1, height, width, 3), float32_model),
+                        tflite,
+                        calibration,
+                        with_sizes=True,
+                    )
+                )
+            metadata["tflite"][f"{height}x{width}"] = tflite_name
+
+    with open(os.path.join(export_dir, "metadata.json"), "w") as f:
+        json.dump(metadata, f)
+    print(f"exported to {export_dir}: {', '.join(sorted(signatures))}")
+    return export_dir
+
+
+def export_main(argv=None):
+    parser = argparse.ArgumentParser(description="Export a trained style as an inference artifact")
+    parser.add_argument("checkpoint", help="path to model_checkpoint.ckpt")
+    parser.add_argument("export_dir")
+    parser.add_argument("--tflite", choices=["float16", "int8"], default=None)
+    parser.add_argument("--calibration-dir", default=None, help="content images for int8")
+    parser.add_argument("--calibration-images", type=int, default=100)
+    parser.add_argument(
+        "--architecture",
+        default=None,
+        help="sweep architecture.json, default the one next to the checkpoint",
+    )
+    args = parser.parse_args(argv)
+
+    architecture = read_architecture(args.checkpoint)
+    if args.architecture is not None:
+        with open(args.architecture) as f:
+            architecture = json.load(f)
+    model = load_style_model(args.checkpoint, **architecture)
+    representative_images = None
+    if args.calibration_dir is not None:
+        paths = find_images(args.calibration_dir)[: args.calibration_images]
+        representative_images = [load_image(path, dim=input_shape[:2]) for path in paths]
+    return export_inference_artifact(
+        model,
+        args.export_dir,
+        tflite=args.tflite,
+        representative_images=representative_images,
+    )
+
+
+if __name__ == "__main__":
+    export_main()
@@ -0,0 +1,102 @@
+"""Import time and memory budget for the package.
+
+Each module is imported in a fresh interpreter, so the numbers are cold
+start costs. Run ``python -m style_transfer.import_budget``; it exits
+non-zero when a module goes over its budget or pulls in a module it should
+defer.
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+
+# module: (baseline module, max extra seconds and MB of peak RSS over the
+# baseline, modules that must not be loaded); modules built on TensorFlow are
+# measured against importing TensorFlow alone, which this package can't shrink
+budgets = {
+    "style_transfer": (None, 0.05, 5, ["tensorflow", "matplotlib", "requests"]),
+    "style_transfer.utils": (None, 0.3, 40, ["tensorflow", "matplotlib", "requests"]),
+    "style_transfer.server": (None, 0.3, 40, ["tensorflow", "matplotlib", "requests"]),
+    "style_transfer.cache": (None, 0.3, 40, ["tensorflow", "matplotlib", "requests"]),
+    "style_transfer.model": ("tensorflow", 0.5, 50, []),
+    "style_transfer.training": ("tensorflow", 0.5, 50, []),
+    "style_transfer.inference": ("tensorflow", 0.5, 50, []),
+}
+
+_probe = """
+import json, resource, sys, time
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    "import_sec": elapsed,
+    "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "loaded": [name for name in {forbidden!r} if name in sys.modules],
+}}))
+"""
+
+
+def measure_import(module, forbidden=(), repeats=3):
+    # best of a few runs, the first one also pays for a cold page cache
+    statement = "pass" if module is None else f"import {module}"
+    runs = []
+    for _ in range(repeats):
+        output = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                _probe.format(statement=statement, forbidden=list(forbidden)),
+            ],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    return min(runs, key=lambda run: run["import_sec"])
+
+
+def check_import_budget(budgets=budgets, repeats=3):
+    failures = []
+    report = {}
+    baselines = {}
+    for module, (baseline, max_sec, max_rss_mb, forbidden) in budgets.items():
+        if baseline not in baselines:
+            baselines[baseline] = measure_import(baseline, repeats=repeats)
+        result = measure_import(module, forbidden, repeats=repeats)
+        result["extra_sec"] = result["import_sec"] - baselines[baseline]["import_sec"]
+        result["extra_rss_mb"] = (
+            result["peak_rss_mb"] - baselines[baseline]["peak_rss_mb"]
+        )
+        report[module] = result
+        status = "ok"
+        if result["extra_sec"] > max_sec:
+            status = f"over {max_sec}s"
+        elif result["extra_rss_mb"] > max_rss_mb:
+            status = f"over {max_rss_mb}MB"
+        elif result["loaded"]:
+            status = "loaded " + ", ".join(result["loaded"])
+        if status != "ok":
+            failures.append(module)
+        print(
+            f"{module:>28}: {result['import_sec']:.2f}s {result['peak_rss_mb']:.0f}MB, "
+            f"+{result['extra_sec']:.2f}s +{result['extra_rss_mb']:.0f}MB over "
+            f"{baseline or 'python'} {status}"
+        )
+    return report, failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check import time and memory budgets")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", default=None, help="write the measurements as JSON")
+    args = parser.parse_args(argv)
+    report, failures = check_import_budget(repeats=args.repeats)
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
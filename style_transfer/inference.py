@@ -0,0 +1,232 @@
+"""Shape bucketed and tiled inference."""
+
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from .layers import InstanceNormalization
+
+
+inference_buckets = [
+    (256, 256),
+    (480, 640),
+    (640, 480),
+    (640, 640),
+    (800, 800),
+    (1080, 1920),
+    (1920, 1080),
+]
+
+
+class BucketedStyleTransfer:
+    def __init__(self, style_model, buckets=inference_buckets, multiple=4):
+        self.style_model = style_model
+        self.buckets = sorted(buckets, key=lambda bucket: bucket[0] * bucket[1])
+        self.multiple = multiple
+        self.norm_layers = instance_norm_layers(style_model)
+        self._functions = {}
+
+    def bucket_for(self, image):
+        height, width = np.shape(image)[-3:-1]
+        for bucket in self.buckets:
+            if height <= bucket[0] and width <= bucket[1]:
+                return bucket
+        # oversized inputs get their own bucket, rounded up so the two
+        # stride-2 convs and the two upsamples give back the same size
+        m = self.multiple
+        return (-(-height // m) * m, -(-width // m) * m)
+
+    def get_function(self, bucket):
+        # oversized inputs share one dynamic shape function, the serving_default
+        # signature of an export, instead of tracing and keeping one per size
+        if bucket not in self.buckets:
+            bucket = (None, None)
+        if bucket not in self._functions:
+            spec = tf.TensorSpec(shape=(None, *bucket, 3), dtype=tf.float32)
+            sizes = tf.TensorSpec(shape=(None, 2), dtype=tf.int32)
+            self._functions[bucket] = tf.function(
+                self._forward, input_signature=[spec, sizes]
+            )
+        return self._functions[bucket]
+
+    def _forward(self, inputs, sizes):
+        # instance norm moments only see each image's own pixels, so the
+        # bucket an image is padded to does not shift its colours, only a band
+        # along the bottom and right edges (about the receptive field wide)
+        # still sees the padding through the convs
+        input_size = tf.shape(inputs)[1:3]
+        for layer in self.norm_layers:
+            layer.valid_sizes = (sizes, input_size)
+        try:
+            outputs = self.style_model(inputs)
+        finally:
+            for layer in self.norm_layers:
+                layer.valid_sizes = None
+        return tf.cast(tf.clip_by_value(outputs, 0, 255), tf.uint8)
+
+    def pad(self, image, bucket):
+        height, width = image.shape[:2]
+        padding = [(0, bucket[0] - height), (0, bucket[1] - width), (0, 0)]
+        mode = "reflect" if min(height, width) > 1 else "edge"
+        return np.pad(image, padding, mode=mode)
+
+    def stylize_batch(self, images):
+        images = [np.asarray(image, dtype=np.float32) for image in images]
+        groups = {}
+        for i, image in enumerate(images):
+            groups.setdefault(self.bucket_for(image), []).append(i)
+        outputs = [None] * len(images)
+        for bucket, indices in groups.items():
+            batch = np.stack([self.pad(images[i], bucket) for i in indices])
+            sizes = np.array([images[i].shape[:2] for i in indices], dtype=np.int32)
+            predicted = self.get_function(bucket)(batch, sizes).numpy()
+            for i, output in zip(indices, predicted):
+                height, width = images[i].shape[:2]
+                outputs[i] = output[:height, :width]
+        return outputs
+
+    def __call__(self, image):
+        if np.ndim(image) > 3:
+            assert np.shape(image)[0] == 1
+            image = image[0]
+        return self.stylize_batch([image])[0]
+
+    def warmup(self, batch_sizes=(1,)):
+        timings = {}
+        for bucket in self.buckets:
+            start = time.perf_counter()
+            for batch_size in batch_sizes:
+                sizes = tf.constant([bucket] * batch_size, dtype=tf.int32)
+                self.get_function(bucket)(tf.zeros((batch_size, *bucket, 3)), sizes)
+            timings[bucket] = time.perf_counter() - start
+            print(f"warmed up bucket {bucket} in {timings[bucket]:.2f}s")
+        return timings
+
+
+def instance_norm_layers(layer):
+    found = []
+    for value in vars(layer).values():
+        if isinstance(value, InstanceNormalization):
+            found.append(value)
+        elif isinstance(value, tf.keras.layers.Layer):
+            found.extend(instance_norm_layers(value))
+    return found
+
+
+class TiledStyleTransfer:
+    def __init__(
+        self,
+        style_model,
+        memory_budget_mb=1024,
+        overlap=64,
+        tile_batch_size=1,
+        stats_max_dim=512,
+        bytes_per_pixel=1024,
+    ):
+        # bytes_per_pixel is a rough upper bound on the live activation memory
+        # StyleTransferModel needs per input pixel (32 channels at full res,
+        # 128 channels at quarter res, float32, a few tensors alive at once)
+        self.style_model = style_model
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self.overlap = overlap
+        self.tile_batch_size = tile_batch_size
+        self.stats_max_dim = stats_max_dim
+        self.bytes_per_pixel = bytes_per_pixel
+        self.norm_layers = instance_norm_layers(style_model)
+
+    def tile_size(self, height, width):
+        # the full resolution float32 output and weight sum (16 bytes per pixel)
+        # and the uint8 result (3) come out of the same budget as the tiles
+        available = self.memory_budget - height * width * 19
+        pixels = max(available, 0) / (self.bytes_per_pixel * self.tile_batch_size)
+        size = int(np.sqrt(pixels)) // 4 * 4
+        if size <= 2 * self.overlap:
+            raise ValueError(
+                f"a {self.memory_budget / 2**20:.0f}MB memory budget is too small for a "
+                f"{height}x{width} image with {self.overlap} pixels of tile overlap"
+            )
+        return size
+
+    def tile_starts(self, length, tile):
+        if length <= tile:
+            return [0]
+        stride = tile - self.overlap
+        starts = list(range(0, length - tile, stride))
+        return starts + [length - tile]
+
+    def blend_weights(self, start, tile, total):
+        # linear ramp over the overlap, except along the image border
+        weights = np.ones(tile, dtype=np.float32)
+        ramp = np.linspace(0, 1, self.overlap + 2, dtype=np.float32)[1:-1]
+        if start > 0:
+            weights[: self.overlap] = ramp
+        if start + tile < total:
+            weights[tile - self.overlap :] = ramp[::-1]
+        return weights
+
+    def compute_norm_statistics(self, image):
+        # instance-norm moments are taken from a downscaled copy of the whole
+        # image so every tile is normalized the same way
+        height, width = image.shape[:2]
+        # the proxy runs before the output buffers exist, it only has to fit itself
+        max_pixels = self.memory_budget / self.bytes_per_pixel
+        scale = min(
+            1.0,
+            self.stats_max_dim / max(height, width),
+            np.sqrt(max_pixels / (height * width)),
+        )
+        size = (max(int(height * scale) // 4 * 4, 4), max(int(width * scale) // 4 * 4, 4))
+        proxy = tf.image.resize(image[np.newaxis].astype(np.float32), size)
+        for layer in self.norm_layers:
+            layer.record_moments = True
+        try:
+            self.style_model(proxy)
+        finally:
+            for layer in self.norm_layers:
+                layer.record_moments = False
+        return {layer: layer.recorded_moments for layer in self.norm_layers}
+
+    def predict_tiles(self, tiles):
+        height, width = tiles[0].shape[:2]
+        padded = (-(-height // 4) * 4, -(-width // 4) * 4)
+        padding = [(0, padded[0] - height), (0, padded[1] - width), (0, 0)]
+        batch = np.stack([np.pad(tile, padding, mode="reflect") for tile in tiles])
+        predicted = self.style_model(batch.astype(np.float32))
+        return np.clip(predicted, 0, 255)[:, :height, :width]
+
+    def __call__(self, image):
+        image = np.asarray(image)
+        if np.ndim(image) > 3:
+            assert image.shape[0] == 1
+            image = image[0]
+        height, width = image.shape[:2]
+        tile = self.tile_size(height, width)
+        tile_h, tile_w = min(tile, height), min(tile, width)
+        statistics = self.compute_norm_statistics(image)
+        output = np.zeros((height, width, 3), dtype=np.float32)
+        weight_sum = np.zeros((height, width, 1), dtype=np.float32)
+        boxes = [
+            (y, x)
+            for y in self.tile_starts(height, tile_h)
+            for x in self.tile_starts(width, tile_w)
+        ]
+        for layer in self.norm_layers:
+            layer.fixed_moments = statistics[layer]
+        try:
+            for i in range(0, len(boxes), self.tile_batch_size):
+                batch_boxes = boxes[i : i + self.tile_batch_size]
+                tiles = [image[y : y + tile_h, x : x + tile_w] for y, x in batch_boxes]
+                for (y, x), predicted in zip(batch_boxes, self.predict_tiles(tiles)):
+                    weights = np.outer(
+                        self.blend_weights(y, tile_h, height),
+                        self.blend_weights(x, tile_w, width),
+                    )[..., np.newaxis]
+                    output[y : y + tile_h, x : x + tile_w] += predicted * weights
+                    weight_sum[y : y + tile_h, x : x + tile_w] += weights
+        finally:
+            for layer in self.norm_layers:
+                layer.fixed_moments = None
+        # in place, a temporary would be another 12 bytes per pixel
+        output /= weight_sum
+        return output.astype(np.uint8)
@@ -0,0 +1,225 @@
+"""Layers of the fast style transfer network."""
+
+import tensorflow as tf
+
+
+class ReflectionPadding2D(tf.keras.layers.Layer):
+    def __init__(self, padding=(1, 1), **kwargs):
+        super(ReflectionPadding2D, self).__init__(**kwargs)
+        self.padding = tuple(padding)
+
+    def call(self, input_tensor):
+        padding_width, padding_height = self.padding
+        return tf.pad(
+            input_tensor,
+            [
+                [0, 0],
+                [padding_height, padding_height],
+                [padding_width, padding_width],
+                [0, 0],
+            ],
+            "REFLECT",
+        )
+
+
+class InstanceNormalization(tf.keras.layers.Layer):
+    def __init__(self, epsilon=1e-3, **kwargs):
+        super(InstanceNormalization, self).__init__(**kwargs)
+        self.epsilon = epsilon
+        # (mean, variance) to use instead of per-image moments, see TiledStyleTransfer
+        self.fixed_moments = None
+        self.record_moments = False
+        self.recorded_moments = None
+        # (sizes, input_size) when inputs are padded, sizes is [batch, 2] valid
+        # height and width of the network input, see BucketedStyleTransfer
+        self.valid_sizes = None
+
+    def build(self, input_shape):
+        channels = input_shape[-1]
+        self.shift = self.add_weight(
+            name="shift", shape=[channels], initializer="zeros"
+        )
+        self.scale = self.add_weight(
+            name="scale", shape=[channels], initializer="ones"
+        )
+        super(InstanceNormalization, self).build(input_shape)
+
+    def moments(self, inputs):
+        if self.fixed_moments is not None:
+            return self.fixed_moments
+        if self.valid_sizes is not None:
+            mu, var = self.valid_moments(inputs)
+        else:
+            mu, var = tf.nn.moments(inputs, [1, 2], keepdims=True)
+        if self.record_moments:
+            self.recorded_moments = (mu, var)
+        return mu, var
+
+    def valid_moments(self, inputs):
+        # moments over the top-left region the unpadded input maps to at this
+        # layer's resolution, so padding does not shift the statistics
+        sizes, input_size = self.valid_sizes
+        size = tf.shape(inputs)[1:3]
+        valid = -(-sizes * size[tf.newaxis] // input_size[tf.newaxis])
+        rows = tf.range(size[0])[tf.newaxis, :] < valid[:, :1]
+        cols = tf.range(size[1])[tf.newaxis, :] < valid[:, 1:]
+        mask = tf.logical_and(rows[:, :, tf.newaxis], cols[:, tf.newaxis, :])
+        mask = tf.cast(mask[..., tf.newaxis], inputs.dtype)
+        count = tf.reduce_sum(mask, axis=[1, 2], keepdims=True)
+        mu = tf.reduce_sum(inputs * mask, axis=[1, 2], keepdims=True) / count
+        var = tf.reduce_sum(tf.square((inputs - mu) * mask), axis=[1, 2], keepdims=True)
+        var = var / count
+        return mu, var
+
+    def call(self, inputs):
+        mu, var = self.moments(inputs)
+        # folds scale into rsqrt(var + eps) so only one multiply-add
+        # touches the full activation map
+        return tf.nn.batch_normalization(
+            inputs, mu, var, self.shift, self.scale, self.epsilon
+        )
+
+    def get_config(self):
+        config = super(InstanceNormalization, self).get_config()
+        config.update({"epsilon": self.epsilon})
+        return config
+
+
+class ConditionalInstanceNormalization(InstanceNormalization):
+    # one scale/shift row per style, picked per image by style_ids
+    def __init__(self, num_styles, **kwargs):
+        super(ConditionalInstanceNormalization, self).__init__(**kwargs)
+        self.num_styles = num_styles
+
+    def build(self, input_shape):
+        channels = input_shape[-1]
+        self.shift = self.add_weight(
+            name="shift", shape=[self.num_styles, channels], initializer="zeros"
+        )
+        self.scale = self.add_weight(
+            name="scale", shape=[self.num_styles, channels], initializer="ones"
+        )
+        super(InstanceNormalization, self).build(input_shape)
+
+    def call(self, inputs, style_ids):
+        mu, var = self.moments(inputs)
+        shift = tf.gather(self.shift, style_ids)[:, tf.newaxis, tf.newaxis, :]
+        scale = tf.gather(self.scale, style_ids)[:, tf.newaxis, tf.newaxis, :]
+        return tf.nn.batch_normalization(inputs, mu, var, shift, scale, self.epsilon)
+
+    def get_config(self):
+        config = super(ConditionalInstanceNormalization, self).get_config()
+        config.update({"num_styles": self.num_styles})
+        return config
+
+
+def normalization_layer(num_styles=None):
+    # moments of reduced precision activations lose too much, normalization
+    # always runs in float32 and the next conv casts back down
+    if num_styles is None:
+        return InstanceNormalization(dtype="float32")
+    return ConditionalInstanceNormalization(num_styles, dtype="float32")
+
+
+def conv_layer(filters, kernel_size, strides=1, separable=False, dtype=None):
+    # a depthwise kxk followed by a 1x1 costs roughly 1/k^2 + 1/filters of a full conv
+    if separable:
+        return tf.keras.layers.SeparableConv2D(filters, kernel_size, strides, dtype=dtype)
+    return tf.keras.layers.Conv2D(filters, kernel_size, strides, dtype=dtype)
+
+
+class ConvLayer(tf.keras.layers.Layer):
+    def __init__(
+        self, filters, kernel_size, strides=1, num_styles=None, separable=False, **kwargs
+    ):
+        super(ConvLayer, self).__init__(**kwargs)
+        self.padding = ReflectionPadding2D(
+            [k // 2 for k in kernel_size], dtype=self.dtype_policy
+        )
+        self.conv2d = conv_layer(
+            filters, kernel_size, strides, separable, dtype=self.dtype_policy
+        )
+        self.bn = normalization_layer(num_styles)
+
+    def call(self, inputs, style_ids=None):
+        x = self.padding(inputs)
+        x = self.conv2d(x)
+        x = self.bn(x) if style_ids is None else self.bn(x, style_ids)
+        return x
+
+
+class ResidualLayer(tf.keras.layers.Layer):
+    def __init__(self, filters, kernel_size, num_styles=None, separable=False, **kwargs):
+        super(ResidualLayer, self).__init__(**kwargs)
+        self.conv2d_1 = ConvLayer(
+            filters,
+            kernel_size,
+            num_styles=num_styles,
+            separable=separable,
+            dtype=self.dtype_policy,
+        )
+        self.conv2d_2 = ConvLayer(
+            filters,
+            kernel_size,
+            num_styles=num_styles,
+            separable=separable,
+            dtype=self.dtype_policy,
+        )
+        self.relu = tf.keras.layers.ReLU(dtype=self.dtype_policy)
+        self.add = tf.keras.layers.Add(dtype=self.dtype_policy)
+
+    def call(self, inputs, style_ids=None):
+        residual = inputs
+        x = self.conv2d_1(inputs, style_ids)
+        x = self.relu(x)
+        x = self.conv2d_2(x, style_ids)
+        x = self.add([x, residual])
+        return x
+
+
+class UpsampleLayer(tf.keras.layers.Layer):
+    # mode "resize" is nearest neighbour upsampling then a conv, "transpose" a
+    # single strided transposed conv: cheaper, but prone to checkerboard artifacts
+    def __init__(
+        self,
+        filters,
+        kernel_size,
+        strides=1,
+        upsample=2,
+        num_styles=None,
+        mode="resize",
+        separable=False,
+        **kwargs
+    ):
+        super(UpsampleLayer, self).__init__(**kwargs)
+        if mode not in ("resize", "transpose"):
+            raise ValueError(f"mode must be 'resize' or 'transpose', got {mode!r}")
+        self.mode = mode
+        if mode == "resize":
+            self.upsample = tf.keras.layers.UpSampling2D(
+                size=upsample, dtype=self.dtype_policy
+            )
+            self.padding = ReflectionPadding2D(
+                [k // 2 for k in kernel_size], dtype=self.dtype_policy
+            )
+            self.conv2d = conv_layer(
+                filters, kernel_size, strides, separable, dtype=self.dtype_policy
+            )
+        else:
+            self.conv2d = tf.keras.layers.Conv2DTranspose(
+                filters,
+                kernel_size,
+                strides=upsample,
+                padding="same",
+                dtype=self.dtype_policy,
+            )
+        self.bn = normalization_layer(num_styles)
+
+    def call(self, inputs, style_ids=None):
+        if self.mode == "resize":
+            x = self.upsample(inputs)
+            x = self.padding(x)
+        else:
+            x = inputs
+        x = self.conv2d(x)
+        return self.bn(x) if style_ids is None else self.bn(x, style_ids)
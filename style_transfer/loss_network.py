@@ -0,0 +1,157 @@
+"""VGG19 feature extractor and cached style targets."""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.applications import vgg19
+from tensorflow.keras.models import Model
+
+from .losses import gram_matrix
+from .precision import get_policy
+
+
+content_layers = ["block4_conv2"]
+
+
+style_layers = [
+    "block1_conv1",
+    "block2_conv1",
+    "block3_conv1",
+    "block4_conv1",
+    "block5_conv1",
+]
+
+
+content_layers_weights = [1]
+
+
+style_layers_weights = [1] * 5
+
+
+class LossModel:
+    def __init__(self, pretrained_model, content_layers, style_layers, precision="float32"):
+        self.precision = precision
+        self.policy = get_policy(precision)
+        self.model_name = pretrained_model.name
+        if precision != "float32":
+            # reduced precision grams differ slightly, keep their cache entries apart
+            self.model_name = f"{pretrained_model.name}_{precision}"
+        self.content_layers = content_layers
+        self.style_layers = style_layers
+        self.loss_model = self.get_model(pretrained_model)
+        self._fingerprint = None
+
+    def get_model(self, pretrained_model):
+        # copy only the layers up to the deepest requested one, so the
+        # unused tail of VGG (and its weights) can be released
+        layer_names = self.style_layers + self.content_layers
+        layers = [layer.name for layer in pretrained_model.layers]
+        deepest = max(layers.index(name) for name in layer_names)
+        inputs = tf.keras.Input(shape=(None, None, 3))
+        x = inputs
+        activations = {}
+        for layer in pretrained_model.layers[1 : deepest + 1]:
+            config = layer.get_config()
+            config["dtype"] = self.policy.name
+            clone = layer.__class__.from_config(config)
+            x = clone(x)
+            clone.set_weights(layer.get_weights())
+            activations[layer.name] = x
+        outputs = [activations[name] for name in layer_names]
+        new_model = Model(
+            inputs=inputs,
+            outputs=outputs,
+            name=f"{pretrained_model.name}_{layers[deepest]}",
+        )
+        new_model.trainable = False
+        return new_model
+
+    def weights_fingerprint(self):
+        # model_name is the same for imagenet and random VGG weights
+        if self._fingerprint is None:
+            digest = hashlib.sha256()
+            for weight in self.loss_model.weights:
+                digest.update(np.asarray(weight).tobytes())
+            self._fingerprint = digest.hexdigest()[:16]
+        return self._fingerprint
+
+    def get_activations(self, inputs):
+        inputs = inputs * 255.0
+        style_length = len(self.style_layers)
+        outputs = self.loss_model(vgg19.preprocess_input(inputs))
+        style_output, content_output = outputs[:style_length], outputs[style_length:]
+        content_dict = {
+            name: value for name, value in zip(self.content_layers, content_output)
+        }
+        style_dict = {
+            name: value for name, value in zip(self.style_layers, style_output)
+        }
+        return {"content": content_dict, "style": style_dict}
+
+    def get_paired_activations(self, predicted, content):
+        # one VGG call for both halves instead of two separate passes
+        batch = tf.shape(predicted)[0]
+        activations = self.get_activations(tf.concat([predicted, content], axis=0))
+        predicted_dict = {
+            kind: {name: value[:batch] for name, value in values.items()}
+            for kind, values in activations.items()
+        }
+        content_dict = {
+            name: tf.stop_gradient(value[batch:])
+            for name, value in activations["content"].items()
+        }
+        return predicted_dict, content_dict
+
+
+class StyleTarget:
+    def __init__(self, loss_model, style_image, cache_dir=None):
+        style_image = np.asarray(style_image, dtype=np.float32)
+        if np.ndim(style_image) == 3:
+            style_image = np.expand_dims(style_image, axis=0)
+        assert style_image.shape[0] == 1
+        self.style_layers = list(loss_model.style_layers)
+        self.key = self.cache_key(
+            style_image,
+            self.style_layers,
+            loss_model.model_name,
+            loss_model.weights_fingerprint(),
+        )
+        self.cache_path = None
+        if cache_dir is not None:
+            self.cache_path = os.path.join(cache_dir, f"style_{self.key}.npz")
+        if self.cache_path is not None and os.path.isfile(self.cache_path):
+            with np.load(self.cache_path) as cached:
+                self.grams = {name: cached[name] for name in self.style_layers}
+        else:
+            style_activations = loss_model.get_activations(style_image)["style"]
+            self.grams = {
+                name: gram_matrix(value).numpy()
+                for name, value in style_activations.items()
+            }
+            if self.cache_path is not None:
+                self.save(self.cache_path)
+
+    @staticmethod
+    def cache_key(style_image, style_layers, model_name, weights_fingerprint):
+        digest = hashlib.sha256()
+        digest.update(np.ascontiguousarray(style_image).tobytes())
+        digest.update(
+            json.dumps(
+                [style_image.shape, style_layers, model_name, weights_fingerprint]
+            ).encode()
+        )
+        return digest.hexdigest()[:16]
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, **self.grams)
+        os.replace(tmp_path, path)
+
+    def broadcast(self, batch_size):
+        return {
+            name: np.repeat(gram, batch_size, axis=0) for name, gram in self.grams.items()
+        }
@@ -0,0 +1,56 @@
+"""Perceptual losses shared by fast style transfer training and the Gatys iteration."""
+
+import tensorflow as tf
+
+
+def content_loss(placeholder, content, weight):
+    assert placeholder.shape == content.shape
+    # reduced precision activations are compared and summed in float32
+    placeholder = tf.cast(placeholder, tf.float32)
+    content = tf.cast(content, tf.float32)
+    return weight * tf.reduce_mean(tf.square(placeholder - content))
+
+
+def gram_matrix(x):
+    # a bfloat16 gram sums height * width products in an 8 bit mantissa
+    x = tf.cast(x, tf.float32)
+    gram = tf.linalg.einsum("bijc,bijd->bcd", x, x)
+    return gram / tf.cast(x.shape[1] * x.shape[2] * x.shape[3], tf.float32)
+
+
+def style_loss(placeholder, style_gram, weight):
+    # style_gram is precomputed once per style and broadcasts over the batch
+    p = gram_matrix(placeholder)
+    return weight * tf.reduce_mean(tf.square(style_gram - p))
+
+
+def preceptual_loss(
+    predicted_activations,
+    content_activations,
+    style_grams,
+    content_weight,
+    style_weight,
+    content_layers_weights,
+    style_layer_weights,
+):
+    pred_content = predicted_activations["content"]
+    pred_style = predicted_activations["style"]
+    c_loss = tf.add_n(
+        [
+            content_loss(
+                pred_content[name], content_activations[name], content_layers_weights[i]
+            )
+            for i, name in enumerate(pred_content.keys())
+        ]
+    )
+    c_loss = c_loss * content_weight
+    s_loss = tf.add_n(
+        [
+            style_loss(
+                pred_style[name], style_grams[name], style_layer_weights[i]
+            )
+            for i, name in enumerate(pred_style.keys())
+        ]
+    )
+    s_loss = s_loss * style_weight
+    return c_loss + s_loss
@@ -0,0 +1,242 @@
+"""The fast style transfer network."""
+
+import json
+import os
+
+import tensorflow as tf
+
+from .layers import ConvLayer, ResidualLayer, UpsampleLayer
+from .precision import get_policy
+
+
+def scaled_filters(filters, width_multiplier):
+    # rounded to a multiple of 8 so the convs keep vectorizing well
+    return max(8, int(filters * width_multiplier + 4) // 8 * 8)
+
+
+class StyleTransferModel(tf.keras.Model):
+    # num_styles switches every InstanceNormalization to a conditional one, so a
+    # single set of conv weights serves num_styles styles picked by style_ids.
+    # precision "bfloat16"/"float16" runs the convs in reduced precision with
+    # float32 weights, so checkpoints are interchangeable with float32 models.
+    # The defaults are the original architecture, width_multiplier,
+    # num_residual_blocks, separable and upsample_mode trade quality for speed
+    def __init__(
+        self,
+        num_styles=None,
+        precision="float32",
+        width_multiplier=1.0,
+        num_residual_blocks=5,
+        separable=False,
+        upsample_mode="resize",
+        **kwargs
+    ):
+        policy = get_policy(precision)
+        super(StyleTransferModel, self).__init__(
+            name="StyleTransferModel", dtype=policy, **kwargs
+        )
+        self.num_styles = num_styles
+        self.precision = precision
+        self.architecture = {
+            "width_multiplier": width_multiplier,
+            "num_residual_blocks": num_residual_blocks,
+            "separable": separable,
+            "upsample_mode": upsample_mode,
+        }
+        self.num_residual_blocks = num_residual_blocks
+        c1, c2, c3 = (scaled_filters(f, width_multiplier) for f in (32, 64, 128))
+        # the 9x9 convs at either end see only 3 image channels, they stay full convs
+        self.conv2d_1 = ConvLayer(
+            filters=c1,
+            kernel_size=(9, 9),
+            strides=1,
+            num_styles=num_styles,
+            dtype=policy,
+            name=f"conv2d_1_{c1}",
+        )
+        self.conv2d_2 = ConvLayer(
+            filters=c2,
+            kernel_size=(3, 3),
+            strides=2,
+            num_styles=num_styles,
+            separable=separable,
+            dtype=policy,
+            name=f"conv2d_2_{c2}",
+        )
+        self.conv2d_3 = ConvLayer(
+            filters=c3,
+            kernel_size=(3, 3),
+            strides=2,
+            num_styles=num_styles,
+            separable=separable,
+            dtype=policy,
+            name=f"conv2d_3_{c3}",
+        )
+        # res_1 ... res_n as attributes, the names checkpoints already use
+        for i in range(1, num_residual_blocks + 1):
+            residual_layer = ResidualLayer(
+                filters=c3,
+                kernel_size=(3, 3),
+                num_styles=num_styles,
+                separable=separable,
+                dtype=policy,
+                name=f"res_{i}_{c3}",
+            )
+            setattr(self, f"res_{i}", residual_layer)
+        self.deconv2d_1 = UpsampleLayer(
+            filters=c2,
+            kernel_size=(3, 3),
+            num_styles=num_styles,
+            mode=upsample_mode,
+            separable=separable,
+            dtype=policy,
+            name=f"deconv2d_1_{c2}",
+        )
+        self.deconv2d_2 = UpsampleLayer(
+            filters=c1,
+            kernel_size=(3, 3),
+            num_styles=num_styles,
+            mode=upsample_mode,
+            separable=separable,
+            dtype=policy,
+            name=f"deconv2d_2_{c1}",
+        )
+        self.deconv2d_3 = ConvLayer(
+            filters=3,
+            kernel_size=(9, 9),
+            strides=1,
+            num_styles=num_styles,
+            dtype=policy,
+            name="deconv2d_3_3",
+        )
+        self.relu = tf.keras.layers.ReLU(dtype=policy)
+
+    def residual_layers(self):
+        return [getattr(self, f"res_{i}") for i in range(1, self.num_residual_blocks + 1)]
+
+    def call(self, inputs, style_ids=None):
+        if self.num_styles is not None and style_ids is None:
+            raise ValueError("a multi-style StyleTransferModel needs style_ids")
+        x = self.conv2d_1(inputs, style_ids)
+        x = self.relu(x)
+        x = self.conv2d_2(x, style_ids)
+        x = self.relu(x)
+        x = self.conv2d_3(x, style_ids)
+        x = self.relu(x)
+        for residual_layer in self.residual_layers():
+            x = residual_layer(x, style_ids)
+        x = self.deconv2d_1(x, style_ids)
+        x = self.relu(x)
+        x = self.deconv2d_2(x, style_ids)
+        x = self.relu(x)
+        x = self.deconv2d_3(x, style_ids)
+        x = (tf.nn.tanh(tf.cast(x, tf.float32)) + 1) * (255.0 / 2)
+        return x
+
+    def print_shape(self, inputs):
+        print(inputs.shape)
+        x = self.conv2d_1(inputs)
+        print(x.shape)
+        x = self.relu(x)
+        x = self.conv2d_2(x)
+        print(x.shape)
+        x = self.relu(x)
+        x = self.conv2d_3(x)
+        print(x.shape)
+        x = self.relu(x)
+        for residual_layer in self.residual_layers():
+            x = residual_layer(x)
+            print(x.shape)
+        x = self.deconv2d_1(x)
+        print(x.shape)
+        x = self.relu(x)
+        x = self.deconv2d_2(x)
+        print(x.shape)
+        x = self.relu(x)
+        x = self.deconv2d_3(x)
+        print(x.shape)
+
+
+def with_precision(style_model, precision):
+    # the same weights running in another precision, e.g. float32 for TFLite
+    if style_model.precision == precision:
+        return style_model
+    model = build_style_model(
+        num_styles=style_model.num_styles, precision=precision, **style_model.architecture
+    )
+    model.set_weights(style_model.get_weights())
+    return model
+
+
+def build_style_model(**model_kwargs):
+    model = StyleTransferModel(**model_kwargs)
+    inputs = tf.zeros((1, *input_shape))
+    if model.num_styles is None:
+        model(inputs)
+    else:
+        model(inputs, style_ids=tf.zeros((1,), dtype=tf.int32))
+    return model
+
+
+def save_style_model(style_model, path):
+    # keras 3 save_weights only writes .weights.h5, a checkpoint rooted at the
+    # model is the layout keras 2 save_weights("*.ckpt") wrote
+    if path.endswith(".weights.h5"):
+        style_model.save_weights(path)
+    else:
+        tf.train.Checkpoint(root=style_model).write(path)
+    return path
+
+
+def read_architecture(checkpoint_path):
+    # architecture.json next to the checkpoint, as written by the sweep
+    path = os.path.join(os.path.dirname(checkpoint_path), "architecture.json")
+    if not os.path.isfile(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def checkpoint_kernels(path):
+    # conv kernels saved in the checkpoint, optimizer slots left out
+    return [
+        name
+        for name, _ in tf.train.list_variables(path)
+        if name.endswith("kernel/.ATTRIBUTES/VARIABLE_VALUE") and ".OPTIMIZER_SLOT" not in name
+    ]
+
+
+def restore_style_model(style_model, path):
+    # style_model must already be built. Checkpoints from before the fused
+    # InstanceNormalization have no scale/shift, those keep scale=1, shift=0
+    if path.endswith(".weights.h5"):
+        style_model.load_weights(path)
+        return style_model
+    kernels = checkpoint_kernels(path)
+    # a TrainingCheckpointer checkpoint keeps the model under "model"
+    model_kernels = [name for name in kernels if name.startswith("model/")]
+    if model_kernels:
+        checkpoint, kernels = tf.train.Checkpoint(model=style_model), model_kernels
+    else:
+        checkpoint = tf.train.Checkpoint(root=style_model)
+    expected = [
+        variable
+        for variable in style_model.trainable_variables
+        if variable.name.split(":")[0].endswith("kernel")
+    ]
+    if len(kernels) != len(expected):
+        raise ValueError(
+            f"{path} has {len(kernels)} conv kernels, the model expects {len(expected)}, "
+            "was it trained with another architecture?"
+        )
+    status = checkpoint.read(path)
+    status.assert_nontrivial_match()
+    status.expect_partial()
+    return style_model
+
+
+def load_style_model(path, **model_kwargs):
+    return restore_style_model(build_style_model(**model_kwargs), path)
+
+
+input_shape = (256, 256, 3)
@@ -0,0 +1,56 @@
+"""Reduced precision policies for the style and loss networks."""
+
+import tensorflow as tf
+
+# precision name -> keras dtype policy, the mixed policies keep float32 weights
+policies = {
+    "float32": "float32",
+    "bfloat16": "mixed_bfloat16",
+    "float16": "mixed_float16",
+}
+
+
+def get_policy(precision):
+    if precision not in policies:
+        raise ValueError(f"precision must be one of {sorted(policies)}, got {precision!r}")
+    return tf.keras.mixed_precision.Policy(policies[precision])
+
+
+def cpu_supports_bfloat16():
+    # AVX512-BF16 and AMX do bfloat16 dot products natively, without them
+    # oneDNN emulates bfloat16 and it is slower than float32
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = f.read().split()
+    except OSError:
+        return False
+    return "avx512_bf16" in flags or "amx_bf16" in flags
+
+
+def default_precision():
+    if cpu_supports_bfloat16() and not tf.config.list_physical_devices("GPU"):
+        return "bfloat16"
+    return "float32"
+
+
+def loss_scale_optimizer(optimizer, precision):
+    # float16 gradients underflow without loss scaling, bfloat16 has the
+    # float32 exponent range and trains without it
+    if precision != "float16":
+        return optimizer
+    return tf.keras.mixed_precision.LossScaleOptimizer(optimizer)
+
+
+def scale_loss(optimizer, loss):
+    if hasattr(optimizer, "get_scaled_loss"):
+        return optimizer.get_scaled_loss(loss)
+    if hasattr(optimizer, "scale_loss"):
+        return optimizer.scale_loss(loss)
+    return loss
+
+
+def unscale_gradients(optimizer, grads):
+    # keras 3 optimizers unscale inside apply_gradients
+    if hasattr(optimizer, "get_unscaled_gradients"):
+        return optimizer.get_unscaled_gradients(grads)
+    return grads
@@ -0,0 +1,53 @@
+"""Lazily built shared models.
+
+Nothing is constructed at import time; the ImageNet VGG19 weights are only
+downloaded the first time vgg or loss_model is requested.
+"""
+
+import threading
+
+_models = {}
+_lock = threading.Lock()
+
+
+def _get(name, build):
+    with _lock:
+        if name not in _models:
+            _models[name] = build()
+        return _models[name]
+
+
+def _build_vgg():
+    from tensorflow.keras.applications import vgg19
+
+    return vgg19.VGG19(weights="imagenet", include_top=False)
+
+
+def get_vgg():
+    return _get("vgg", _build_vgg)
+
+
+def get_loss_model(precision="float32"):
+    def build():
+        from .loss_network import LossModel, content_layers, style_layers
+
+        # only a vgg someone asked for is kept, otherwise the full network is
+        # dropped once the truncated copy exists and its unused tail is freed
+        vgg = _models["vgg"] if "vgg" in _models else _build_vgg()
+        return LossModel(vgg, content_layers, style_layers, precision=precision)
+
+    name = "loss_model" if precision == "float32" else f"loss_model_{precision}"
+    return _get(name, build)
+
+
+def get_style_model():
+    def build():
+        import tensorflow as tf
+
+        from .model import StyleTransferModel, input_shape
+
+        model = StyleTransferModel()
+        model(tf.zeros((1, *input_shape)))
+        return model
+
+    return _get("style_model", build)
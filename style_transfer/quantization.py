@@ -0,0 +1,118 @@
+"""Int8 post-training quantization report."""
+
+import json
+import os
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from .export import convert_to_tflite
+from .losses import gram_matrix, preceptual_loss
+from .model import load_style_model, read_architecture
+
+
+def run_tflite(model_content, images, num_threads=None):
+    interpreter = tf.lite.Interpreter(model_content=model_content, num_threads=num_threads)
+    interpreter.allocate_tensors()
+    input_index = interpreter.get_input_details()[0]["index"]
+    output_index = interpreter.get_output_details()[0]["index"]
+    outputs = []
+    start = time.perf_counter()
+    for image in images:
+        interpreter.set_tensor(input_index, image[np.newaxis].astype(np.float32))
+        interpreter.invoke()
+        outputs.append(interpreter.get_tensor(output_index)[0])
+    latency = (time.perf_counter() - start) / len(images)
+    return np.stack(outputs), latency
+
+
+def perceptual_distance(loss_model, predicted, reference, content_weight, style_weight):
+    predicted_activations = loss_model.get_activations(predicted / 255.0)
+    reference_activations = loss_model.get_activations(reference / 255.0)
+    reference_grams = {
+        name: gram_matrix(value) for name, value in reference_activations["style"].items()
+    }
+    return float(
+        tf.reduce_mean(
+            preceptual_loss(
+                predicted_activations,
+                reference_activations["content"],
+                reference_grams,
+                content_weight,
+                style_weight,
+                [1] * len(loss_model.content_layers),
+                [1] * len(loss_model.style_layers),
+            )
+        )
+    )
+
+
+def sample_loader_images(loader, num_images):
+    # the loader yields [0, 1] batches, the style network expects [0, 255]
+    images = loader.dataset.unbatch().take(num_images)
+    return [image.numpy() * 255.0 for image in images]
+
+
+def quantization_report(
+    style_checkpoints,
+    loss_model,
+    loader,
+    num_calibration=100,
+    num_eval=20,
+    image_size=(256, 256),
+    content_weight=1e1,
+    style_weight=1e2,
+    output_dir=None,
+):
+    samples = sample_loader_images(loader, num_calibration + num_eval)
+    calibration, eval_images = samples[:num_calibration], samples[num_calibration:]
+    eval_batch = np.stack(eval_images).astype(np.float32)
+    spec = tf.TensorSpec(shape=(1, *image_size, 3), dtype=tf.float32, name="image")
+    report = {}
+    for style_name, checkpoint in style_checkpoints.items():
+        model = load_style_model(checkpoint, **read_architecture(checkpoint))
+
+        @tf.function(input_signature=[spec])
+        def forward(inputs):
+            return tf.cast(tf.clip_by_value(model(inputs), 0, 255), tf.uint8)
+
+        concrete_function = forward.get_concrete_function()
+        float32_model = convert_to_tflite(concrete_function, None)
+        int8_model = convert_to_tflite(concrete_function, "int8", calibration)
+        reference, float32_latency = run_tflite(float32_model, eval_images)
+        quantized, int8_latency = run_tflite(int8_model, eval_images)
+        forward(eval_batch[:1])
+        start = time.perf_counter()
+        for image in eval_batch:
+            forward(image[np.newaxis])
+        tf_latency = (time.perf_counter() - start) / len(eval_batch)
+
+        reference = reference.astype(np.float32)
+        quantized = quantized.astype(np.float32)
+        report[style_name] = {
+            "tf_float32_ms": tf_latency * 1000,
+            "tflite_float32_ms": float32_latency * 1000,
+            "tflite_int8_ms": int8_latency * 1000,
+            "speedup_vs_tflite_float32": float32_latency / int8_latency,
+            "speedup_vs_tf_float32": tf_latency / int8_latency,
+            "psnr": float(tf.reduce_mean(tf.image.psnr(reference, quantized, 255.0))),
+            "ssim": float(tf.reduce_mean(tf.image.ssim(reference, quantized, 255.0))),
+            "perceptual_loss": perceptual_distance(
+                loss_model, quantized, reference, content_weight, style_weight
+            ),
+        }
+        if output_dir is not None:
+            os.makedirs(output_dir, exist_ok=True)
+            with open(os.path.join(output_dir, f"{style_name}_int8.tflite"), "wb") as f:
+                f.write(int8_model)
+        print(
+            f"{style_name}: int8 {report[style_name]['speedup_vs_tflite_float32']:.2f}x "
+            f"faster than float32 tflite, PSNR {report[style_name]['psnr']:.1f}dB "
+            f"SSIM {report[style_name]['ssim']:.3f} "
+            f"perceptual {report[style_name]['perceptual_loss']:.2f}"
+        )
+    if output_dir is not None:
+        with open(os.path.join(output_dir, "quantization_report.json"), "w") as f:
+            json.dump(report, f, indent=2)
+    return report
@@ -0,0 +1,120 @@
+"""LRU registry of trained styles."""
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import tensorflow as tf
+
+from .model import load_style_model, read_architecture
+
+
+class StyleRegistry:
+    def __init__(
+        self,
+        checkpoint_root=None,
+        max_models=8,
+        max_memory_mb=None,
+        loader_threads=2,
+        wrap=None,
+    ):
+        self.max_models = max_models
+        self.max_memory = max_memory_mb * 1024 * 1024 if max_memory_mb else None
+        # e.g. wrap=BucketedStyleTransfer to keep compiled graphs resident too
+        self.wrap = wrap
+        self.checkpoints = {}
+        self.model_kwargs = {}
+        self.models = OrderedDict()
+        self.memory = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.load_times = []
+        self._loading = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(loader_threads)
+        if checkpoint_root is not None:
+            for index_path in sorted(Path(checkpoint_root).glob("*/model_checkpoint.ckpt.index")):
+                self.register(index_path.parent.name, str(index_path)[: -len(".index")])
+
+    def register(self, style, checkpoint_path, **model_kwargs):
+        # model_kwargs (num_styles, precision, architecture) override an
+        # architecture.json next to the checkpoint
+        kwargs = read_architecture(checkpoint_path)
+        kwargs.update(model_kwargs)
+        self.checkpoints[style] = checkpoint_path
+        self.model_kwargs[style] = kwargs
+
+    def styles(self):
+        return sorted(self.checkpoints)
+
+    def get(self, style, timeout=None):
+        with self._lock:
+            if style in self.models:
+                self.hits += 1
+                self.models.move_to_end(style)
+                return self.models[style][0]
+            self.misses += 1
+            future = self._load_async(style)
+        return future.result(timeout=timeout)
+
+    def prefetch(self, style):
+        with self._lock:
+            if style in self.models:
+                future = Future()
+                future.set_result(self.models[style][0])
+                return future
+            return self._load_async(style)
+
+    def _load_async(self, style):
+        # callers hold self._lock
+        if style not in self.checkpoints:
+            raise KeyError(f"unknown style: {style}")
+        if style not in self._loading:
+            future = self._executor.submit(self._load, style)
+            self._loading[style] = future
+        return self._loading[style]
+
+    def _load(self, style):
+        start = time.perf_counter()
+        try:
+            model = load_style_model(self.checkpoints[style], **self.model_kwargs[style])
+            size = sum(int(np.prod(w.shape)) * tf.as_dtype(w.dtype).size for w in model.weights)
+            entry = self.wrap(model) if self.wrap is not None else model
+        except Exception:
+            with self._lock:
+                self._loading.pop(style, None)
+            raise
+        with self._lock:
+            self._loading.pop(style, None)
+            self.load_times.append(time.perf_counter() - start)
+            self.models[style] = (entry, size)
+            self.memory += size
+            self._evict()
+        return entry
+
+    def _evict(self):
+        while len(self.models) > 1 and (
+            len(self.models) > self.max_models
+            or (self.max_memory is not None and self.memory > self.max_memory)
+        ):
+            _, (_, size) = self.models.popitem(last=False)
+            self.memory -= size
+            self.evictions += 1
+
+    def metrics(self):
+        with self._lock:
+            requests_count = self.hits + self.misses
+            return {
+                "resident": list(self.models),
+                "memory_mb": self.memory / (1024 * 1024),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests_count if requests_count else 0.0,
+                "evictions": self.evictions,
+                "loads": len(self.load_times),
+                "mean_load_sec": float(np.mean(self.load_times)) if self.load_times else 0.0,
+            }
@@ -0,0 +1,163 @@
+"""Dynamic batching inference server."""
+
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+
+
+def stylize_batch(style_model, images, style_ids=None):
+    batch = np.stack([np.asarray(image, dtype=np.float32) for image in images])
+    if style_ids is None:
+        predicted = style_model(batch)
+    else:
+        # a conditional model mixes styles freely within one batch
+        predicted = style_model(batch, style_ids=np.asarray(style_ids, dtype=np.int32))
+    predicted = np.clip(predicted, 0, 255).astype(np.uint8)
+    return list(predicted)
+
+
+class InferenceResult:
+    def __init__(self, image, queue_latency, compute_latency, batch_size):
+        self.image = image
+        self.queue_latency = queue_latency
+        self.compute_latency = compute_latency
+        self.batch_size = batch_size
+
+    def __repr__(self):
+        return (
+            f"InferenceResult(shape={self.image.shape}, "
+            f"queue={self.queue_latency * 1000:.1f}ms, "
+            f"compute={self.compute_latency * 1000:.1f}ms, "
+            f"batch_size={self.batch_size})"
+        )
+
+
+class StyleTransferServer:
+    def __init__(
+        self,
+        style_model,
+        max_batch_size=8,
+        max_wait_ms=10,
+        bucket_fn=None,
+        batch_fn=None,
+    ):
+        self.style_model = style_model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.bucket_fn = bucket_fn or (lambda image: image.shape)
+        self.batch_fn = batch_fn or (lambda images: stylize_batch(style_model, images))
+        self.num_requests = 0
+        self.num_batches = 0
+        self._requests = queue.Queue()
+        self._pending = OrderedDict()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._running = False
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._running = True
+                self._thread = threading.Thread(target=self._serve, daemon=True)
+                self._thread.start()
+        return self
+
+    def stop(self):
+        with self._lock:
+            thread = self._thread
+            self._running = False
+            self._thread = None
+        if thread is not None:
+            self._requests.put(None)
+            thread.join()
+        # anything that slipped in behind the stop marker is never served
+        while True:
+            try:
+                request = self._requests.get_nowait()
+            except queue.Empty:
+                break
+            if request:
+                request[1].set_exception(RuntimeError("StyleTransferServer was stopped"))
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def submit(self, image):
+        image = np.asarray(image)
+        if np.ndim(image) > 3:
+            assert image.shape[0] == 1
+            image = image[0]
+        future = Future()
+        with self._lock:
+            if not self._running:
+                raise RuntimeError("StyleTransferServer is not running")
+            self._requests.put((image, future, time.perf_counter()))
+        return future
+
+    def stylize(self, image, timeout=None):
+        return self.submit(image).result(timeout=timeout)
+
+    def stats(self):
+        return {
+            "requests": self.num_requests,
+            "batches": self.num_batches,
+            "mean_batch_size": self.num_requests / max(self.num_batches, 1),
+        }
+
+    def _serve(self):
+        running = True
+        while running or self._pending:
+            timeout = None
+            if self._pending:
+                oldest = min(batch[0][2] for batch in self._pending.values())
+                timeout = max(oldest + self.max_wait - time.perf_counter(), 0)
+            if running:
+                try:
+                    request = self._requests.get(timeout=timeout)
+                except queue.Empty:
+                    request = False
+                if request is None:
+                    running = False
+                elif request:
+                    try:
+                        bucket = self.bucket_fn(request[0])
+                    except Exception as e:
+                        # a malformed image fails its own request, not the server
+                        request[1].set_exception(e)
+                        continue
+                    self._pending.setdefault(bucket, []).append(request)
+                    if len(self._pending[bucket]) >= self.max_batch_size:
+                        self._dispatch(bucket)
+            now = time.perf_counter()
+            for bucket in list(self._pending):
+                if not running or now - self._pending[bucket][0][2] >= self.max_wait:
+                    self._dispatch(bucket)
+
+    def _dispatch(self, bucket):
+        batch = self._pending.pop(bucket)
+        start = time.perf_counter()
+        try:
+            outputs = self.batch_fn([image for image, _, _ in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                return
+            # run the requests one by one so only the bad ones fail
+            for request in batch:
+                self._pending[bucket] = [request]
+                self._dispatch(bucket)
+            return
+        end = time.perf_counter()
+        self.num_requests += len(batch)
+        self.num_batches += 1
+        for (_, future, submitted), output in zip(batch, outputs):
+            future.set_result(
+                InferenceResult(output, start - submitted, end - start, len(batch))
+            )
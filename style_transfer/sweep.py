@@ -0,0 +1,383 @@
+"""Train or distill smaller style transfer architectures and compare them."""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.applications import vgg19
+from tensorflow.python.profiler import model_analyzer, option_builder
+
+from .benchmark import benchmark_metadata, synthetic_images, time_case
+from .data import TensorflowDatasetLoader
+from .loss_network import (
+    LossModel,
+    StyleTarget,
+    content_layers,
+    content_layers_weights,
+    style_layers,
+    style_layers_weights,
+)
+from .losses import content_loss, preceptual_loss
+from .model import (
+    StyleTransferModel,
+    input_shape,
+    load_style_model,
+    read_architecture,
+    save_style_model,
+)
+from .precision import loss_scale_optimizer, policies, scale_loss, unscale_gradients
+from .training import make_train_step
+from .utils import load_image
+
+# the first entry is the full size model, the others are judged against it
+# when there is no teacher
+default_variants = [
+    {},
+    {"upsample_mode": "transpose"},
+    {"num_residual_blocks": 3},
+    {"width_multiplier": 0.5},
+    {"separable": True},
+    {"width_multiplier": 0.5, "num_residual_blocks": 3},
+    {"width_multiplier": 0.5, "separable": True},
+    {
+        "width_multiplier": 0.25,
+        "num_residual_blocks": 3,
+        "separable": True,
+        "upsample_mode": "transpose",
+    },
+]
+
+
+def variant_name(architecture):
+    if not architecture:
+        return "full"
+    return ",".join(f"{key}={value}" for key, value in sorted(architecture.items()))
+
+
+def model_flops(style_model, height, width):
+    # counted on the traced graph of one image, a multiply-add is 2 flops
+    spec = tf.TensorSpec((1, height, width, 3), tf.float32)
+    graph = tf.function(style_model).get_concrete_function(spec).graph
+    options = (
+        option_builder.ProfileOptionBuilder(
+            option_builder.ProfileOptionBuilder.float_operation()
+        )
+        .with_empty_output()
+        .build()
+    )
+    return model_analyzer.profile(graph, options=options).total_float_ops
+
+
+def make_distill_step(
+    student,
+    teacher,
+    loss_model,
+    optimizer,
+    style_grams,
+    content_weight=1e1,
+    style_weight=1e2,
+    total_variation_weight=0.004,
+    content_layers_weights=[1],
+    style_layers_weights=[1] * 5,
+    distill_weight=1.0,
+    jit_compile=False,
+):
+    # the usual perceptual loss plus a content loss towards the teacher's
+    # stylization, which hands the student what the teacher learned over a
+    # full training run in far fewer steps
+    style_grams = {name: tf.constant(gram) for name, gram in style_grams.items()}
+
+    def step(input_image_batch):
+        target = tf.clip_by_value(teacher(input_image_batch), 0, 255)
+        teacher_content = tf.nest.map_structure(
+            tf.stop_gradient, loss_model.get_activations(target / 255.0)["content"]
+        )
+        with tf.GradientTape() as tape:
+            outputs = tf.clip_by_value(student(input_image_batch), 0, 255)
+            pred_activations, content_activations = loss_model.get_paired_activations(
+                outputs / 255.0, input_image_batch
+            )
+            curr_loss = preceptual_loss(
+                pred_activations,
+                content_activations,
+                style_grams,
+                content_weight,
+                style_weight,
+                content_layers_weights,
+                style_layers_weights,
+            )
+            curr_loss += total_variation_weight * tf.image.total_variation(outputs)
+            distill_loss = tf.add_n(
+                [
+                    content_loss(
+                        pred_activations["content"][name],
+                        teacher_content[name],
+                        content_layers_weights[i],
+                    )
+                    for i, name in enumerate(teacher_content.keys())
+                ]
+            )
+            curr_loss += distill_weight * content_weight * distill_loss
+            scaled_loss = scale_loss(optimizer, curr_loss)
+        grad = tape.gradient(scaled_loss, student.trainable_variables)
+        grad = unscale_gradients(optimizer, grad)
+        optimizer.apply_gradients(zip(grad, student.trainable_variables))
+        return curr_loss
+
+    return tf.function(step, jit_compile=jit_compile)
+
+
+def evaluate_style_model(
+    style_model,
+    loss_model,
+    batches,
+    style_grams,
+    content_weight=1e1,
+    style_weight=1e2,
+    total_variation_weight=0.004,
+    teacher=None,
+):
+    # mean perceptual loss per image, and with a teacher how far the outputs
+    # are from the teacher's in VGG content space
+    losses = []
+    gaps = []
+    for batch in batches:
+        outputs = tf.clip_by_value(style_model(batch), 0, 255)
+        pred_activations, content_activations = loss_model.get_paired_activations(
+            outputs / 255.0, batch
+        )
+        curr_loss = preceptual_loss(
+            pred_activations,
+            content_activations,
+            style_grams,
+            content_weight,
+            style_weight,
+            content_layers_weights,
+            style_layers_weights,
+        )
+        curr_loss += total_variation_weight * tf.image.total_variation(outputs)
+        losses.append(float(tf.reduce_mean(curr_loss)))
+        if teacher is not None:
+            target = tf.clip_by_value(teacher(batch), 0, 255)
+            teacher_content = loss_model.get_activations(target / 255.0)["content"]
+            gaps.append(
+                float(
+                    tf.add_n(
+                        [
+                            content_loss(pred_activations["content"][name], value, 1.0)
+                            for name, value in teacher_content.items()
+                        ]
+                    )
+                )
+            )
+    quality = {"perceptual_loss": float(np.mean(losses))}
+    if teacher is not None:
+        quality["teacher_content_gap"] = float(np.mean(gaps))
+    return quality
+
+
+def fastest_within(results, max_loss_ratio):
+    passing = [result for result in results if result["loss_ratio"] <= max_loss_ratio]
+    if not passing:
+        return None
+    return min(passing, key=lambda result: result["latency_p50_ms"])["name"]
+
+
+def architecture_sweep(
+    dataset,
+    style_grams,
+    loss_model,
+    variants=default_variants,
+    teacher=None,
+    steps=200,
+    eval_batches=4,
+    resolution=(256, 256),
+    latency_iterations=10,
+    learning_rate=1e-3,
+    content_weight=1e1,
+    style_weight=1e2,
+    total_variation_weight=0.004,
+    distill_weight=1.0,
+    precision="float32",
+    max_loss_ratio=None,
+    save_dir=None,
+):
+    # every variant trains (or distills from teacher) for the same number of
+    # steps, the first eval_batches batches are held out of its first epoch
+    weights = dict(
+        content_weight=content_weight,
+        style_weight=style_weight,
+        total_variation_weight=total_variation_weight,
+    )
+    held_out = list(dataset.take(eval_batches))
+    height, width = resolution
+    latency_image = synthetic_images(1, height, width)
+    reference_loss = None
+    teacher_loss = None
+    if teacher is not None:
+        teacher_loss = evaluate_style_model(
+            teacher, loss_model, held_out, style_grams, **weights
+        )["perceptual_loss"]
+        reference_loss = teacher_loss
+    results = []
+    for architecture in variants:
+        name = variant_name(architecture)
+        model = StyleTransferModel(precision=precision, **architecture)
+        model(latency_image)
+        optimizer = loss_scale_optimizer(
+            tf.keras.optimizers.Adam(learning_rate=learning_rate), precision
+        )
+        if teacher is not None:
+            step = make_distill_step(
+                model,
+                teacher,
+                loss_model,
+                optimizer,
+                style_grams,
+                content_layers_weights=content_layers_weights,
+                style_layers_weights=style_layers_weights,
+                distill_weight=distill_weight,
+                **weights,
+            )
+        else:
+            step = make_train_step(
+                model,
+                loss_model,
+                optimizer,
+                style_grams,
+                content_weight,
+                style_weight,
+                total_variation_weight,
+                content_layers_weights,
+                style_layers_weights,
+                shared_forward=True,
+            )
+        iterator = iter(dataset.skip(eval_batches))
+        curr_loss = None
+        start = time.perf_counter()
+        for _ in range(steps):
+            curr_loss = step(next(iterator))
+        if curr_loss is not None:
+            # wait for the last step before stopping the clock
+            float(tf.reduce_mean(curr_loss))
+        train_sec = time.perf_counter() - start
+
+        inference = tf.function(model)
+        latency = time_case(
+            lambda: inference(latency_image), 1, iterations=latency_iterations, warmup=2
+        )
+        quality = evaluate_style_model(
+            model, loss_model, held_out, style_grams, teacher=teacher, **weights
+        )
+        if reference_loss is None:
+            reference_loss = quality["perceptual_loss"]
+        result = {
+            "name": name,
+            "architecture": dict(model.architecture),
+            "params": model.count_params(),
+            "gflops": model_flops(model, height, width) / 1e9,
+            "latency_p50_ms": latency["p50_ms"],
+            "latency_p90_ms": latency["p90_ms"],
+            "images_per_sec": latency["images_per_sec"],
+            "train_sec": train_sec,
+            "loss_ratio": quality["perceptual_loss"] / reference_loss,
+        }
+        result.update(quality)
+        results.append(result)
+        print(
+            f"{name:>40}: {result['params'] / 1e6:.2f}M params, "
+            f"{result['gflops']:.2f} GFLOPs, p50 {result['latency_p50_ms']:.1f}ms, "
+            f"loss {result['perceptual_loss']:.4g} ({result['loss_ratio']:.2f}x)"
+        )
+        if save_dir is not None:
+            variant_dir = os.path.join(save_dir, name)
+            os.makedirs(variant_dir, exist_ok=True)
+            save_style_model(model, os.path.join(variant_dir, "model_checkpoint.ckpt"))
+            with open(os.path.join(variant_dir, "architecture.json"), "w") as f:
+                json.dump(result["architecture"], f)
+
+    report = {
+        "metadata": benchmark_metadata(),
+        "resolution": list(resolution),
+        "steps": steps,
+        "distilled": teacher is not None,
+        "teacher_loss": teacher_loss,
+        "results": results,
+    }
+    if max_loss_ratio is not None:
+        report["max_loss_ratio"] = max_loss_ratio
+        report["fastest_within_bar"] = fastest_within(results, max_loss_ratio)
+        print(f"fastest within {max_loss_ratio:.2f}x loss: {report['fastest_within_bar']}")
+    return report
+
+
+def sweep_main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Train or distill smaller style transfer architectures"
+    )
+    parser.add_argument("dataset_path", help="directory of training .jpg images")
+    parser.add_argument("style_image")
+    parser.add_argument(
+        "--teacher", default=None, help="full size model_checkpoint.ckpt to distill"
+    )
+    parser.add_argument("--variants", default=None, help="JSON file with a list of architectures")
+    parser.add_argument("--steps", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--num-images", type=int, default=None)
+    parser.add_argument("--record-dir", default=None)
+    parser.add_argument("--eval-batches", type=int, default=4)
+    parser.add_argument("--latency-iterations", type=int, default=10)
+    parser.add_argument("--max-loss-ratio", type=float, default=None)
+    parser.add_argument("--precision", choices=sorted(policies), default="float32")
+    parser.add_argument("--vgg-weights", default="imagenet", help="'none' for random weights")
+    parser.add_argument("--save-dir", default=None)
+    parser.add_argument("--output", default="sweep.json")
+    args = parser.parse_args(argv)
+
+    variants = default_variants
+    if args.variants is not None:
+        with open(args.variants) as f:
+            variants = json.load(f)
+    vgg_weights = None if args.vgg_weights == "none" else args.vgg_weights
+    loss_model = LossModel(
+        vgg19.VGG19(weights=vgg_weights, include_top=False), content_layers, style_layers
+    )
+    style_image = load_image(args.style_image, dim=input_shape[:2], resize=True) / 255.0
+    style_grams = StyleTarget(loss_model, style_image).grams
+    loader = TensorflowDatasetLoader(
+        args.dataset_path,
+        batch_size=args.batch_size,
+        image_size=input_shape[:2],
+        num_images=args.num_images,
+        record_dir=args.record_dir,
+        shuffle_buffer=1024,
+        seed=0,
+    )
+    teacher = None
+    if args.teacher is not None:
+        teacher = load_style_model(args.teacher, **read_architecture(args.teacher))
+    report = architecture_sweep(
+        loader.dataset,
+        style_grams,
+        loss_model,
+        variants=variants,
+        teacher=teacher,
+        steps=args.steps,
+        eval_batches=args.eval_batches,
+        resolution=input_shape[:2],
+        latency_iterations=args.latency_iterations,
+        precision=args.precision,
+        max_loss_ratio=args.max_loss_ratio,
+        save_dir=args.save_dir,
+    )
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(sweep_main())
@@ -0,0 +1,390 @@
+"""Compiled training step, metrics and checkpointing."""
+
+import glob
+import json
+import os
+import resource
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from .losses import preceptual_loss
+from .model import save_style_model
+from .precision import scale_loss, unscale_gradients
+
+
+def sync_devices():
+    # GPU ops return before they finish, wait so each phase gets its own time
+    if hasattr(tf.test.experimental, "sync_devices"):
+        tf.test.experimental.sync_devices()
+
+
+def timed(timings, phase, fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    sync_devices()
+    timings[phase] = timings.get(phase, 0.0) + time.perf_counter() - start
+    return result
+
+
+def make_train_step(
+    style_model,
+    loss_model,
+    optimizer,
+    style_grams,
+    content_weight=1e4,
+    style_weight=1e-2,
+    total_variation_weight=0.004,
+    content_layers_weights=[1],
+    style_layers_weights=[1] * 5,
+    jit_compile=False,
+    shared_forward=False,
+    num_replicas=1,
+    phase_timing=False,
+):
+    # a list of gram dicts (one per style) trains a conditional model, the
+    # compiled step then takes the style id of the batch as a second argument
+    multi_style = isinstance(style_grams, (list, tuple))
+    if multi_style:
+        style_grams = {
+            name: tf.constant(np.stack([grams[name] for grams in style_grams]))
+            for name in style_grams[0]
+        }
+    else:
+        style_grams = {name: tf.constant(gram) for name, gram in style_grams.items()}
+
+    def select_style(input_image_batch, style_id):
+        if not multi_style:
+            return None, style_grams
+        style_ids = tf.fill(tf.shape(input_image_batch)[:1], style_id)
+        batch_grams = {
+            name: tf.gather(gram, style_id) for name, gram in style_grams.items()
+        }
+        return style_ids, batch_grams
+
+    def style_forward(input_image_batch, style_ids):
+        if multi_style:
+            outputs = style_model(input_image_batch, style_ids=style_ids)
+        else:
+            outputs = style_model(input_image_batch)
+        return tf.clip_by_value(outputs, 0, 255)
+
+    def vgg_forward(outputs, input_image_batch):
+        if shared_forward:
+            return loss_model.get_paired_activations(outputs / 255.0, input_image_batch)
+        # content targets don't depend on the weights, keep them out of the backward pass
+        content_activations = tf.nest.map_structure(
+            tf.stop_gradient, loss_model.get_activations(input_image_batch)["content"]
+        )
+        return loss_model.get_activations(outputs / 255.0), content_activations
+
+    def loss(outputs, pred_activations, content_activations, batch_grams):
+        curr_loss = preceptual_loss(
+            pred_activations,
+            content_activations,
+            batch_grams,
+            content_weight,
+            style_weight,
+            content_layers_weights,
+            style_layers_weights,
+        )
+        return curr_loss + total_variation_weight * tf.image.total_variation(outputs)
+
+    def apply(grad):
+        optimizer.apply_gradients(zip(grad, style_model.trainable_variables))
+
+    def step(input_image_batch, style_id=None):
+        style_ids, batch_grams = select_style(input_image_batch, style_id)
+        with tf.GradientTape() as tape:
+            outputs = style_forward(input_image_batch, style_ids)
+            pred_activations, content_activations = vgg_forward(
+                outputs, input_image_batch
+            )
+            curr_loss = loss(outputs, pred_activations, content_activations, batch_grams)
+            # replicas sum their gradients in apply_gradients, scale to get the mean
+            replica_loss = curr_loss / num_replicas
+            # no-op unless the optimizer is a LossScaleOptimizer (float16)
+            scaled_loss = scale_loss(optimizer, replica_loss)
+        grad = tape.gradient(scaled_loss, style_model.trainable_variables)
+        apply(unscale_gradients(optimizer, grad))
+        return curr_loss
+
+    if not phase_timing:
+        return tf.function(step, jit_compile=jit_compile)
+
+    # the same step split into separately compiled phases with a device sync in
+    # between, slower than the fused step but it shows where the time goes
+    compiled_forward = tf.function(style_forward, jit_compile=jit_compile)
+    compiled_vgg = tf.function(vgg_forward, jit_compile=jit_compile)
+    compiled_loss = tf.function(loss, jit_compile=jit_compile)
+    compiled_apply = tf.function(apply)
+
+    def phase_step(input_image_batch, style_id=None):
+        timings = {}
+        style_ids, batch_grams = select_style(input_image_batch, style_id)
+        with tf.GradientTape() as tape:
+            outputs = timed(
+                timings, "style_forward", compiled_forward, input_image_batch, style_ids
+            )
+            pred_activations, content_activations = timed(
+                timings, "vgg_forward", compiled_vgg, outputs, input_image_batch
+            )
+            curr_loss = timed(
+                timings,
+                "loss",
+                compiled_loss,
+                outputs,
+                pred_activations,
+                content_activations,
+                batch_grams,
+            )
+            replica_loss = curr_loss / num_replicas
+            scaled_loss = scale_loss(optimizer, replica_loss)
+        grad = timed(
+            timings, "backward", tape.gradient, scaled_loss, style_model.trainable_variables
+        )
+        timed(timings, "optimizer", compiled_apply, unscale_gradients(optimizer, grad))
+        return curr_loss, timings
+
+    return phase_step
+
+
+class TrainingMetrics:
+    # running loss, per phase seconds, images/sec and peak memory, written every
+    # log_every steps to a JSON lines file and/or TensorBoard
+    def __init__(
+        self,
+        batch_size,
+        log_every=100,
+        jsonl_path=None,
+        tensorboard_dir=None,
+        profile_steps=None,
+        profile_dir=None,
+    ):
+        self.batch_size = batch_size
+        self.log_every = log_every
+        self.jsonl_path = jsonl_path
+        self.writer = None
+        if tensorboard_dir is not None:
+            self.writer = tf.summary.create_file_writer(tensorboard_dir)
+        # (first, last) global steps to capture with the TF profiler
+        self.profile_steps = profile_steps
+        self.profile_dir = profile_dir or tensorboard_dir or "profile"
+        self.profiling = False
+        self.loss = tf.keras.metrics.Mean(name="loss")
+        self.phases = {}
+        self.phase_steps = 0
+        self.window_start = time.perf_counter()
+        self.window_steps = 0
+        self.records = []
+
+    def start_step(self, step):
+        if self.profile_steps is not None and step == self.profile_steps[0]:
+            tf.profiler.experimental.start(self.profile_dir)
+            self.profiling = True
+
+    def end_step(self, step, curr_loss, timings, phase_timings=None):
+        # curr_loss stays on device, Mean accumulates without a host sync
+        self.loss.update_state(curr_loss)
+        for phase, seconds in timings.items():
+            self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+        if phase_timings is not None:
+            self.phase_steps += 1
+            for phase, seconds in phase_timings.items():
+                key = "model/" + phase
+                self.phases[key] = self.phases.get(key, 0.0) + seconds
+        self.window_steps += 1
+        if self.profiling and step >= self.profile_steps[1]:
+            tf.profiler.experimental.stop()
+            self.profiling = False
+        if step % self.log_every == 0:
+            return self.log(step)
+        return None
+
+    def peak_memory_mb(self):
+        memory = {"peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+        for device in tf.config.list_logical_devices("GPU"):
+            info = tf.config.experimental.get_memory_info(device.name)
+            memory[f"peak_{device.name}_mb"] = info["peak"] / 2**20
+        return memory
+
+    def log(self, step):
+        elapsed = time.perf_counter() - self.window_start
+        record = {
+            "step": int(step),
+            "loss": float(self.loss.result()),
+            "steps_per_sec": self.window_steps / elapsed,
+            "images_per_sec": self.window_steps * self.batch_size / elapsed,
+        }
+        for phase, seconds in self.phases.items():
+            # model/ phases are only measured on the phase timed steps
+            count = self.phase_steps if phase.startswith("model/") else self.window_steps
+            record[f"{phase}_ms"] = 1000 * seconds / max(count, 1)
+        record.update(self.peak_memory_mb())
+        self.records.append(record)
+        if self.jsonl_path is not None:
+            with open(self.jsonl_path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+        if self.writer is not None:
+            with self.writer.as_default():
+                for name, value in record.items():
+                    if name != "step":
+                        tf.summary.scalar(name, value, step=step)
+            self.writer.flush()
+        self.loss.reset_state()
+        self.phases = {}
+        self.phase_steps = 0
+        self.window_start = time.perf_counter()
+        self.window_steps = 0
+        return record
+
+    def close(self):
+        if self.profiling:
+            tf.profiler.experimental.stop()
+            self.profiling = False
+        if self.writer is not None:
+            self.writer.close()
+
+
+class TrainingCheckpointer:
+    # model, optimizer slots, global step and the style sampling rng are written
+    # asynchronously, the training loop only pays for the device to host copy
+    def __init__(self, directory, style_model, optimizer, max_to_keep=3, seed=None):
+        self.directory = directory
+        self.max_to_keep = max_to_keep
+        self.step = tf.Variable(0, dtype=tf.int64, trainable=False)
+        if seed is None:
+            self.rng = tf.random.Generator.from_non_deterministic_state()
+        else:
+            self.rng = tf.random.Generator.from_seed(seed)
+        self.objects = dict(
+            model=style_model, optimizer=optimizer, step=self.step, rng=self.rng
+        )
+        try:
+            self.options = tf.train.CheckpointOptions(
+                experimental_enable_async_checkpoint=True
+            )
+        except TypeError:
+            # TF releases without async checkpointing fall back to blocking writes
+            self.options = tf.train.CheckpointOptions()
+        self.pending = None
+        self.restored = None
+        self.save_seconds = []
+        os.makedirs(directory, exist_ok=True)
+
+    def checkpoints(self):
+        # an .index only appears once a checkpoint is completely written
+        steps = sorted(
+            int(name[len("ckpt-") : -len(".index")])
+            for name in os.listdir(self.directory)
+            if name.startswith("ckpt-") and name.endswith(".index")
+        )
+        return [os.path.join(self.directory, f"ckpt-{step}") for step in steps]
+
+    def restore(self):
+        paths = self.checkpoints()
+        if not paths:
+            return False
+        # optimizer slots are created on the first apply_gradients and restored then
+        self.restored = tf.train.Checkpoint(**self.objects).restore(paths[-1])
+        return True
+
+    def save(self):
+        start = time.perf_counter()
+        self.sync()
+        for path in self.checkpoints()[: -self.max_to_keep + 1 or None]:
+            for file_path in glob.glob(path + ".*"):
+                os.remove(file_path)
+        # a fresh Checkpoint per save, reusing one breaks repeated async saves on Keras 3
+        checkpoint = tf.train.Checkpoint(**self.objects)
+        path = checkpoint.write(
+            os.path.join(self.directory, f"ckpt-{int(self.step.numpy())}"),
+            options=self.options,
+        )
+        self.pending = checkpoint
+        self.save_seconds.append(time.perf_counter() - start)
+        return path
+
+    def sync(self):
+        # blocks until the pending async write is on disk
+        if self.pending is not None and hasattr(self.pending, "sync"):
+            self.pending.sync()
+        self.pending = None
+
+    def data_iterator(self, dataset):
+        # a freshly built seeded loader replays the same batches, so one iterator fed
+        # through every epoch sees batch number `step` next; skipping replays the
+        # pipeline instead of storing the decoded shuffle buffer in every checkpoint
+        return iter(dataset.skip(int(self.step.numpy())))
+
+
+def train_step(
+    dataset,
+    compiled_step,
+    steps_per_epoch,
+    style_model,
+    checkpoint_path="./",
+    num_styles=None,
+    seed=None,
+    checkpointer=None,
+    checkpoint_every=1000,
+    metrics=None,
+    phase_step=None,
+    phase_every=100,
+):
+    epoch_loss = tf.keras.metrics.Mean(name="epoch_loss")
+    steps = 1
+    save_path = os.path.join(checkpoint_path, f"model_checkpoint.ckpt")
+    if checkpointer is None:
+        print("Model Checkpoint Path: ", save_path)
+        rng = tf.random.Generator.from_seed(0 if seed is None else seed)
+    else:
+        rng = checkpointer.rng
+    # an iterator passed in keeps its position across epochs
+    iterator = iter(dataset)
+    for _ in range(steps_per_epoch):
+        global_step = int(checkpointer.step.numpy()) + 1 if checkpointer else steps
+        if metrics is not None:
+            metrics.start_step(global_step)
+        timings = {}
+        if metrics is None:
+            input_image_batch = next(iterator)
+        else:
+            input_image_batch = timed(timings, "data_wait", next, iterator)
+        if num_styles is None:
+            args = (input_image_batch,)
+        else:
+            # one style per batch, sampled uniformly so every style sees every content
+            args = (input_image_batch, rng.uniform([], 0, num_styles, dtype=tf.int32))
+        phase_timings = None
+        step_start = time.perf_counter()
+        if phase_step is not None and steps % phase_every == 0:
+            curr_loss, phase_timings = phase_step(*args)
+        else:
+            curr_loss = compiled_step(*args)
+        if metrics is not None:
+            sync_devices()
+            timings["step"] = time.perf_counter() - step_start
+        epoch_loss.update_state(curr_loss)
+        if checkpointer is not None:
+            checkpointer.step.assign_add(1)
+        if steps == 1:
+            # the first call traces (and with XLA compiles) the step, leave it out of steps/sec
+            start = time.perf_counter()
+        if steps % checkpoint_every == 0:
+            checkpoint_start = time.perf_counter()
+            if checkpointer is None:
+                print("checkpoint saved ", end=" ")
+                save_style_model(style_model, save_path)
+            else:
+                print(f"checkpoint saved {checkpointer.save()}", end=" ")
+            timings["checkpoint"] = time.perf_counter() - checkpoint_start
+            print(f"Loss: {epoch_loss.result().numpy()}", end=" ")
+            print(f"steps/sec: {(steps - 1) / (time.perf_counter() - start):.2f}")
+        if metrics is not None:
+            metrics.end_step(global_step, curr_loss, timings, phase_timings)
+        steps += 1
+    if steps > 2:
+        print(f"steps/sec: {(steps - 2) / (time.perf_counter() - start):.2f}")
+    return epoch_loss.result()
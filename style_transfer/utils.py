@@ -0,0 +1,100 @@
+"""Image loading and plotting helpers.
+
+matplotlib and requests are imported on first use, so worker processes that
+only decode images never pay for them.
+"""
+
+import threading
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+_http_session = None
+_http_session_lock = threading.Lock()
+_pyplot = None
+
+
+def get_http_session():
+    # one pooled session keeps connections alive across repeated downloads
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            import requests
+
+            session = requests.Session()
+            for prefix in ("https://", "http://"):
+                session.mount(
+                    prefix,
+                    requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=16),
+                )
+            _http_session = session
+    return _http_session
+
+
+def get_pyplot():
+    global _pyplot
+    if _pyplot is None:
+        import matplotlib
+        import matplotlib.pyplot as plt
+
+        matplotlib.rcParams["figure.figsize"] = (12, 12)
+        matplotlib.rcParams["axes.grid"] = False
+        _pyplot = plt
+    return _pyplot
+
+
+def load_image(image_path, dim=None, resize=False):
+    img = Image.open(image_path)
+    if dim:
+        if resize:
+            img = img.resize(dim)
+        else:
+            img.thumbnail(dim)
+    img = img.convert("RGB")
+    return np.array(img)
+
+
+def load_url_image(url, dim=None, resize=False, session=None):
+    img_request = (session or get_http_session()).get(url, timeout=60)
+    img_request.raise_for_status()
+    img = Image.open(BytesIO(img_request.content))
+    if dim:
+        if resize:
+            img = img.resize(dim)
+        else:
+            img.thumbnail(dim)
+    img = img.convert("RGB")
+    return np.array(img)
+
+
+def array_to_img(array):
+    array = np.array(array, dtype=np.uint8)
+    if np.ndim(array) > 3:
+        assert array.shape[0] == 1
+        array = array[0]
+    return Image.fromarray(array)
+
+
+def show_image(image, title=None):
+    plt = get_pyplot()
+    if len(image.shape) > 3:
+        image = np.squeeze(image, axis=0)
+    plt.imshow(image)
+    if title:
+        plt.title = title
+
+
+def plot_images_grid(images, num_rows=1):
+    plt = get_pyplot()
+    n = len(images)
+    if n > 1:
+        num_cols = np.ceil(n / num_rows)
+        fig, axes = plt.subplots(ncols=int(num_cols), nrows=int(num_rows))
+        axes = axes.flatten()
+        fig.set_size_inches((15, 15))
+        for i, image in enumerate(images):
+            axes[i].imshow(image)
+    else:
+        plt.figure(figsize=(10, 10))
+        plt.imshow(images[0])
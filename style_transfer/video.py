@@ -0,0 +1,168 @@
+"""Pipelined video stylization."""
+
+import queue
+import threading
+import time
+
+import numpy as np
+
+from .server import stylize_batch
+
+
+class StageTimer:
+    def __init__(self, name):
+        self.name = name
+        self.frames = 0
+        self.busy = 0.0
+
+    def add(self, frames, seconds):
+        self.frames += frames
+        self.busy += seconds
+
+    def fps(self):
+        return self.frames / self.busy if self.busy else 0.0
+
+
+def decode_video_frames(input_path, frames, timer, stop):
+    import cv2
+
+    capture = cv2.VideoCapture(input_path)
+    try:
+        while not stop.is_set():
+            start = time.perf_counter()
+            ok, frame = capture.read()
+            if not ok:
+                break
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            timer.add(1, time.perf_counter() - start)
+            frames.put(frame)
+    finally:
+        capture.release()
+        frames.put(None)
+
+
+def encode_video_frames(output_path, fps, size, frames, timer, codec="mp4v"):
+    import cv2
+
+    writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*codec), fps, size)
+    if not writer.isOpened():
+        raise RuntimeError(f"could not open {output_path} for writing with codec {codec}")
+    width, height = size
+    try:
+        while True:
+            frame = frames.get()
+            if frame is None:
+                break
+            # VideoWriter silently drops frames of any other size or type
+            if frame.shape != (height, width, 3) or frame.dtype != np.uint8:
+                raise ValueError(
+                    f"stylized frame is {frame.shape} {frame.dtype}, "
+                    f"the video is {(height, width, 3)} uint8"
+                )
+            start = time.perf_counter()
+            writer.write(cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
+            timer.add(1, time.perf_counter() - start)
+    finally:
+        writer.release()
+
+
+def put_while_alive(frames, frame, consumer):
+    while consumer.is_alive():
+        try:
+            frames.put(frame, timeout=0.1)
+            return
+        except queue.Full:
+            pass
+
+
+def stylize_video(
+    style_model,
+    input_path,
+    output_path,
+    batch_size=8,
+    max_queue=32,
+    batch_fn=None,
+    codec="mp4v",
+):
+    import cv2
+
+    def crop_to_inputs(images):
+        # frame sides that are not multiples of 4 come back rounded up
+        outputs = stylize_batch(style_model, images)
+        return [
+            output[: image.shape[0], : image.shape[1]]
+            for image, output in zip(images, outputs)
+        ]
+
+    batch_fn = batch_fn or crop_to_inputs
+    capture = cv2.VideoCapture(input_path)
+    fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+    size = (
+        int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+    )
+    capture.release()
+
+    timers = {name: StageTimer(name) for name in ["decode", "infer", "encode"]}
+    decoded = queue.Queue(maxsize=max_queue)
+    stylized = queue.Queue(maxsize=max_queue)
+    stop = threading.Event()
+    errors = []
+
+    def run(target, *args):
+        try:
+            target(*args)
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+
+    decoder = threading.Thread(
+        target=run,
+        args=(decode_video_frames, input_path, decoded, timers["decode"], stop),
+        daemon=True,
+    )
+    encoder = threading.Thread(
+        target=run,
+        args=(encode_video_frames, output_path, fps, size, stylized, timers["encode"], codec),
+        daemon=True,
+    )
+    start = time.perf_counter()
+    decoder.start()
+    encoder.start()
+    try:
+        done = False
+        while not done and not stop.is_set():
+            batch = []
+            while len(batch) < batch_size:
+                frame = decoded.get()
+                if frame is None:
+                    done = True
+                    break
+                batch.append(frame)
+            if batch:
+                infer_start = time.perf_counter()
+                outputs = batch_fn(batch)
+                timers["infer"].add(len(batch), time.perf_counter() - infer_start)
+                for output in outputs:
+                    put_while_alive(stylized, output, encoder)
+    finally:
+        stop.set()
+        # unblock the decoder if it is waiting on a full queue
+        while decoder.is_alive():
+            try:
+                decoded.get_nowait()
+            except queue.Empty:
+                decoder.join(0.01)
+        put_while_alive(stylized, None, encoder)
+        encoder.join()
+    if errors:
+        raise errors[0]
+    elapsed = time.perf_counter() - start
+    frames = timers["encode"].frames
+    report = {name: timer.fps() for name, timer in timers.items()}
+    report["overall"] = frames / elapsed if elapsed else 0.0
+    print(
+        f"{frames} frames in {elapsed:.1f}s - "
+        + ", ".join(f"{name}: {value:.1f} fps" for name, value in report.items())
+    )
+    return report
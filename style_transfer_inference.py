@@ -0,0 +1,165 @@
+"""Loads an exported style transfer model for inference.
+
+Only numpy and TensorFlow (or tflite_runtime for .tflite files) are
+imported, and only when a model is loaded, so worker processes start
+without pulling in VGG19, matplotlib or the training code.
+"""
+
+import argparse
+import json
+import os
+import resource
+import time
+
+import numpy as np
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def valid_sizes(image):
+    # the unpadded size, instance norm moments are taken over this region only
+    return np.array([image.shape[:2]], dtype=np.int32)
+
+
+def pad_to(image, shape):
+    height, width = image.shape[:2]
+    padding = [(0, shape[0] - height), (0, shape[1] - width), (0, 0)]
+    mode = "reflect" if min(height, width) > 1 else "edge"
+    return np.pad(image, padding, mode=mode)[np.newaxis]
+
+
+class SavedModelStylizer:
+    def __init__(self, export_dir):
+        import tensorflow as tf
+
+        self.tf = tf
+        with open(os.path.join(export_dir, "metadata.json")) as f:
+            metadata = json.load(f)
+        self.buckets = sorted(
+            (tuple(bucket) for bucket in metadata["buckets"]),
+            key=lambda bucket: bucket[0] * bucket[1],
+        )
+        # serving_default needs sizes the stride-2 convs and upsamples give back
+        self.multiple = metadata.get("multiple", 4)
+        self.model = tf.saved_model.load(export_dir)
+
+    def bucket_for(self, height, width):
+        for bucket in self.buckets:
+            if height <= bucket[0] and width <= bucket[1]:
+                return bucket
+        return None
+
+    def __call__(self, image):
+        image = np.asarray(image, dtype=np.float32)
+        height, width = image.shape[:2]
+        bucket = self.bucket_for(height, width)
+        if bucket is None:
+            signature = self.model.signatures["serving_default"]
+            m = self.multiple
+            padded = (-(-height // m) * m, -(-width // m) * m)
+        else:
+            signature = self.model.signatures[f"stylize_{bucket[0]}x{bucket[1]}"]
+            padded = bucket
+        inputs = pad_to(image, padded)
+        outputs = signature(
+            image=self.tf.constant(inputs), sizes=self.tf.constant(valid_sizes(image))
+        )["stylized"]
+        return outputs.numpy()[0, :height, :width]
+
+
+class TFLiteStylizer:
+    def __init__(self, export_dir, num_threads=None):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+
+            Interpreter = tf.lite.Interpreter
+        self.Interpreter = Interpreter
+        self.num_threads = num_threads
+        with open(os.path.join(export_dir, "metadata.json")) as f:
+            metadata = json.load(f)
+        self.paths = {}
+        for name, file_name in metadata["tflite"].items():
+            height, width = (int(size) for size in name.split("x"))
+            self.paths[(height, width)] = os.path.join(export_dir, file_name)
+        self.buckets = sorted(self.paths, key=lambda bucket: bucket[0] * bucket[1])
+        self.interpreters = {}
+
+    def get_interpreter(self, bucket):
+        if bucket not in self.interpreters:
+            interpreter = self.Interpreter(
+                model_path=self.paths[bucket], num_threads=self.num_threads
+            )
+            interpreter.allocate_tensors()
+            self.interpreters[bucket] = interpreter
+        return self.interpreters[bucket]
+
+    def __call__(self, image):
+        image = np.asarray(image, dtype=np.float32)
+        height, width = image.shape[:2]
+        fitting = [b for b in self.buckets if height <= b[0] and width <= b[1]]
+        if not fitting:
+            raise ValueError(f"{height}x{width} is larger than every exported bucket")
+        interpreter = self.get_interpreter(fitting[0])
+        # the int32 input is the unpadded size, the float32 one the image
+        for detail in interpreter.get_input_details():
+            if detail["dtype"] == np.int32:
+                interpreter.set_tensor(detail["index"], valid_sizes(image))
+            else:
+                interpreter.set_tensor(detail["index"], pad_to(image, fitting[0]))
+        output_index = interpreter.get_output_details()[0]["index"]
+        interpreter.invoke()
+        return interpreter.get_tensor(output_index)[0, :height, :width]
+
+
+def load_stylizer(export_dir, tflite=False, num_threads=None):
+    if tflite:
+        return TFLiteStylizer(export_dir, num_threads=num_threads)
+    return SavedModelStylizer(export_dir)
+
+
+def measure_cold_start(export_dir, tflite=False, image_shape=(480, 640, 3)):
+    # run in a fresh process, import/load times are only meaningful the first time
+    timings = {}
+    start = time.perf_counter()
+    if tflite:
+        try:
+            import tflite_runtime.interpreter  # noqa: F401
+        except ImportError:
+            import tensorflow  # noqa: F401
+    else:
+        import tensorflow  # noqa: F401
+    timings["import_sec"] = time.perf_counter() - start
+    timings["import_peak_rss_mb"] = peak_rss_mb()
+
+    start = time.perf_counter()
+    stylizer = load_stylizer(export_dir, tflite=tflite)
+    timings["load_sec"] = time.perf_counter() - start
+    timings["load_peak_rss_mb"] = peak_rss_mb()
+
+    image = np.random.RandomState(0).randint(0, 256, image_shape).astype(np.float32)
+    start = time.perf_counter()
+    stylizer(image)
+    timings["first_inference_sec"] = time.perf_counter() - start
+    timings["first_inference_peak_rss_mb"] = peak_rss_mb()
+
+    start = time.perf_counter()
+    stylizer(image)
+    timings["second_inference_sec"] = time.perf_counter() - start
+    return timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure cold start of an exported style")
+    parser.add_argument("export_dir")
+    parser.add_argument("--tflite", action="store_true")
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--width", type=int, default=640)
+    args = parser.parse_args()
+    timings = measure_cold_start(
+        args.export_dir, tflite=args.tflite, image_shape=(args.height, args.width, 3)
+    )
+    print(json.dumps(timings, indent=2))